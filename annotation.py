@@ -0,0 +1,63 @@
+import base64
+import io
+
+try:
+    from urllib import quote
+except ImportError:
+    from urllib.parse import quote
+
+import cv2
+
+# RGB colours of the overlay.
+BOX_COLOR = (153, 255, 204)
+LANDMARK_COLOR = (102, 204, 255)
+TEXT_COLOR = (152, 255, 204)
+
+
+def faceOverlay(bb, landmarks, landmarkIndices, name):
+    """The annotation of one face as plain data for the browser to draw."""
+    return {
+        "box": [bb.left(), bb.top(), bb.right(), bb.bottom()],
+        "landmarks": [list(landmarks[p]) for p in landmarkIndices],
+        "name": name
+    }
+
+
+def drawOverlay(frame, overlay, bgr=False):
+    """Draw a faceOverlay onto an RGB (or, with bgr, BGR) frame in place."""
+    order = slice(None, None, -1) if bgr else slice(None)
+    left, top, right, bottom = overlay["box"]
+    cv2.rectangle(frame, (left, bottom), (right, top), color=BOX_COLOR[order],
+                  thickness=3)
+    for p in overlay["landmarks"]:
+        cv2.circle(frame, center=tuple(p), radius=3,
+                   color=LANDMARK_COLOR[order], thickness=-1)
+    cv2.putText(frame, overlay["name"], (left, top - 10),
+                cv2.FONT_HERSHEY_SIMPLEX, fontScale=0.75,
+                color=TEXT_COLOR[order], thickness=2)
+
+
+def encodeJpeg(bgrFrame, quality):
+    ok, jpeg = cv2.imencode('.jpg', bgrFrame, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+    assert ok
+    return 'data:image/jpeg;base64,' + base64.b64encode(jpeg.tostring()).decode('ascii')
+
+
+def encodePng(rgbFrame):
+    """The legacy matplotlib rendering of an RGB frame.
+
+    Uses a standalone Figure rather than pyplot, so nothing is left in
+    pyplot's global figure list and worker threads do not share state.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    ax.imshow(rgbFrame)
+    ax.set_xticks([])
+    ax.set_yticks([])
+    imgdata = io.BytesIO()
+    fig.savefig(imgdata, format='png')
+    return 'data:image/png;base64,' + quote(base64.b64encode(imgdata.getvalue()))
@@ -0,0 +1,367 @@
+#!/usr/bin/env python2
+"""Headless batch identification and evaluation.
+
+Runs the recognition stages of websocket-server.py (frame decode, face
+detection, alignment, batched embedding, SVM or nearest-neighbour
+classification) over a directory of images or a video file, without a
+browser or WebSocket. Predictions are streamed to CSV or JSONL in the
+ActualMail/PredictedMail/Result terms of results.csv, and an accuracy and
+throughput summary is printed and optionally saved as JSON.
+
+For a directory laid out like training_images/ (<user id>/<image>), the
+user id of each image's directory is its ground truth; for a video,
+--actual names the person in it. Examples:
+
+    ./batch_identify.py --input testset/ --output predictions.csv
+    ./batch_identify.py --input session.mp4 --actual 20180429123000 \\
+        --output predictions.jsonl --summary summary.json
+"""
+
+from __future__ import print_function
+
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import pickle
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from multiprocessing.pool import ThreadPool
+
+import cv2
+import numpy as np
+
+from batcher import EmbeddingBatcher
+from detection import FaceDetector, largestBox
+from frame_codec import EncodedFrame
+from gallery_index import EmbeddingIndex
+from gallery_store import GalleryStore
+from quality import QualityGate
+from user_store import UserStore
+
+fileDir = os.path.dirname(os.path.realpath(__file__))
+modelDir = os.path.join(fileDir, 'models')
+dlibModelDir = os.path.join(modelDir, 'dlib')
+openfaceModelDir = os.path.join(modelDir, 'openface')
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+UNKNOWN = 'Unknown'
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--input', type=str, required=True,
+                    help='Directory of images (searched recursively) or a video file')
+parser.add_argument('--output', type=str, default='predictions.csv',
+                    help='Predictions file; .jsonl writes JSON lines, anything else CSV')
+parser.add_argument('--summary', type=str, default=None,
+                    help='Also write the accuracy and throughput summary to this JSON file')
+parser.add_argument('--actual', type=str, default=None,
+                    help='User id of the person in a video, or of every image in the input')
+parser.add_argument('--aligned', action='store_true',
+                    help='Inputs are already aligned faces (as in training_images/); '
+                         'skip detection and alignment')
+parser.add_argument('--noMirror', action='store_true',
+                    help="Do not mirror frames; the live pipeline mirrors every webcam frame")
+parser.add_argument('--videoStride', type=int, default=1,
+                    help='Identify every Nth video frame')
+parser.add_argument('--qualityGate', action='store_true',
+                    help='Reject faces that fail the live quality gate (default thresholds)')
+parser.add_argument('--dlibFacePredictor', type=str, help="Path to dlib's face predictor.",
+                    default=os.path.join(dlibModelDir, "shape_predictor_68_face_landmarks.dat"))
+parser.add_argument('--networkModel', type=str, help="Path to Torch network model.",
+                    default=os.path.join(openfaceModelDir, 'nn4.small2.v1.t7'))
+parser.add_argument('--imgDim', type=int,
+                    help="Default image dimension.", default=96)
+parser.add_argument('--cuda', action='store_true')
+parser.add_argument('--stubModels', action='store_true',
+                    help='Use the stand-in models from stub_models.py')
+parser.add_argument('--classifier', type=str, choices=['svm', 'knn'], default='svm',
+                    help='Identify with the SVM in --model or a nearest-neighbour gallery '
+                         'loaded from --galleryStore')
+parser.add_argument('--model', type=str, default='model.sav',
+                    help='Pickled SVM to evaluate')
+parser.add_argument('--galleryStore', type=str, default='gallery',
+                    help='Prefix of the gallery saved by the server, used as the '
+                         'nearest-neighbour gallery')
+parser.add_argument('--knnMetric', type=str, choices=['l2', 'cosine'], default='l2')
+parser.add_argument('--knnThreshold', type=float, default=0.99)
+parser.add_argument('--knnNeighbours', type=int, default=1)
+parser.add_argument('--userDb', type=str, default='users.db',
+                    help='SQLite database mapping user ids to mail addresses')
+parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+                    help='Threads running decode, detection and alignment')
+parser.add_argument('--batchSize', type=int, default=8,
+                    help='Maximum number of faces embedded in one batch')
+parser.add_argument('--batchWait', type=float, default=10,
+                    help='Maximum time (ms) a face waits for its batch to fill')
+parser.add_argument('--detectScale', type=float, default=1.0,
+                    help='Run face detection on the frame downscaled by this factor')
+
+
+def imageInputs(path):
+    """(source, actual id, None) for every image under path, in order."""
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                imgPath = os.path.join(dirpath, name)
+                actual = args.actual or os.path.basename(os.path.dirname(imgPath))
+                yield (imgPath, actual, None)
+
+
+def videoInputs(path):
+    """(source, actual id, BGR frame) for every --videoStride-th frame."""
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        sys.exit("Cannot open video {}".format(path))
+    frameNum = 0
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            if frameNum % max(1, args.videoStride) == 0:
+                if not args.noMirror:
+                    frame = cv2.flip(frame, 1)
+                yield ("{}#{}".format(path, frameNum), args.actual, frame)
+            frameNum += 1
+    finally:
+        capture.release()
+
+
+def chunks(iterable, n):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == n:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Identifier:
+    """The live recognition stages, callable from many threads at once."""
+
+    def __init__(self, align, batcher, classify, qualityGate=None):
+        self.align = align
+        self.batcher = batcher
+        self.classify = classify
+        self.qualityGate = qualityGate
+        # FaceDetector keeps per-session state, so one per thread.
+        self.local = threading.local()
+
+    def detector(self):
+        detector = getattr(self.local, 'detector', None)
+        if detector is None:
+            detector = self.local.detector = FaceDetector(self.align, scale=args.detectScale)
+        return detector
+
+    def alignedFace(self, frame):
+        """(aligned face, status) for the largest face in frame."""
+        bbs = self.detector().detect(frame)
+        if len(bbs) == 0:
+            return (None, 'no_face')
+        bb = largestBox(bbs)
+        status = 'ok' if len(bbs) == 1 else 'multiple_faces'
+        if self.qualityGate is not None:
+            reason = self.qualityGate.checkFace(frame, bb)
+            if reason is not None:
+                return (None, reason)
+        landmarks = self.align.findLandmarks(frame, bb)
+        if self.qualityGate is not None:
+            reason = self.qualityGate.checkPose(landmarks)
+            if reason is not None:
+                return (None, reason)
+        alignedFace = self.align.align(args.imgDim, frame, bb, landmarks=landmarks,
+                                       landmarkIndices=openface.AlignDlib.OUTER_EYES_AND_NOSE)
+        if alignedFace is None:
+            return (None, 'not_aligned')
+        return (alignedFace, status)
+
+    def __call__(self, item):
+        (source, actual, frame) = item
+        start = time.time()
+        result = {"source": source, "actual": actual, "identity": None, "status": 'ok'}
+        try:
+            if frame is None:
+                with open(source, 'rb') as f:
+                    payload = f.read()
+                if args.aligned:
+                    frame = cv2.imdecode(np.frombuffer(payload, dtype=np.uint8),
+                                         cv2.IMREAD_COLOR)
+                elif args.noMirror:
+                    frame = cv2.imdecode(np.frombuffer(payload, dtype=np.uint8),
+                                         cv2.IMREAD_COLOR)
+                else:
+                    frame = EncodedFrame(payload=payload).decode()
+            if args.aligned:
+                alignedFace, status = frame, 'ok'
+            else:
+                alignedFace, status = self.alignedFace(frame)
+            result["status"] = status
+            if alignedFace is not None:
+                rep = self.batcher.forward(alignedFace)
+                result["identity"] = int(self.classify(rep))
+        except Exception as e:
+            result["status"] = 'error: {}'.format(e)
+        result["latencyMs"] = 1000.0 * (time.time() - start)
+        return result
+
+
+def loadClassifier():
+    if args.classifier == 'knn':
+        index = EmbeddingIndex(metric=args.knnMetric, threshold=args.knnThreshold,
+                               k=args.knnNeighbours)
+        saved = GalleryStore.open(args.galleryStore)
+        if saved is None:
+            sys.exit("No saved gallery at {}".format(args.galleryStore))
+        for phash, rep, identity in saved.items():
+            index.add(phash, rep, identity)
+        print("+ Gallery index holds {} reps.".format(len(index)))
+        return index.predict
+    with open(args.model, 'rb') as f:
+        svm = pickle.load(f)
+    return lambda rep: svm.predict(np.asarray(rep).reshape(1, -1))[0]
+
+
+class Writer:
+    """Streams prediction rows to CSV (like results.csv) or JSON lines."""
+    FIELDS = ['S.No', 'ActualMail', 'PredictedMail', 'Result',
+              'Source', 'Identity', 'Status', 'LatencyMs']
+
+    def __init__(self, path):
+        self.f = open(path, 'w')
+        self.jsonl = path.endswith('.jsonl')
+        if not self.jsonl:
+            self.csv = csv.DictWriter(self.f, self.FIELDS)
+            self.csv.writeheader()
+
+    def write(self, row):
+        if self.jsonl:
+            self.f.write(json.dumps(row) + '\n')
+        else:
+            self.csv.writerow(row)
+
+    def close(self):
+        self.f.close()
+
+
+class Evaluation:
+    """Accuracy per ActualMail, confusions and throughput."""
+
+    def __init__(self):
+        self.start = time.time()
+        self.numInputs = 0
+        self.statuses = Counter()
+        self.perActual = defaultdict(Counter)
+        self.latencies = []
+
+    def add(self, actualMail, predictedMail, status, latencyMs):
+        self.numInputs += 1
+        self.statuses[status] += 1
+        self.latencies.append(latencyMs)
+        if actualMail is not None:
+            self.perActual[actualMail][predictedMail] += 1
+
+    def summary(self, batcherStats):
+        elapsed = time.time() - self.start
+        evaluated = sum(sum(c.values()) for c in self.perActual.values())
+        correct = sum(c[mail] for mail, c in self.perActual.items())
+        latencies = sorted(self.latencies)
+        perActual = {}
+        for mail, predictions in sorted(self.perActual.items()):
+            total = sum(predictions.values())
+            perActual[mail] = {
+                "images": total,
+                "accuracy": predictions[mail] / float(total),
+                "confusions": dict((p, n) for p, n in predictions.most_common(5) if p != mail)
+            }
+        return {
+            "inputs": self.numInputs,
+            "statuses": dict(self.statuses),
+            "evaluated": evaluated,
+            "correct": correct,
+            "accuracy": correct / float(max(1, evaluated)),
+            "perActualMail": perActual,
+            "elapsedSec": elapsed,
+            "imagesPerSec": self.numInputs / max(elapsed, 1e-9),
+            "p50LatencyMs": latencies[len(latencies) // 2] if latencies else None,
+            "p95LatencyMs": latencies[int(0.95 * (len(latencies) - 1))] if latencies else None,
+            "batcher": batcherStats
+        }
+
+
+def main():
+    if os.path.isdir(args.input):
+        inputs = imageInputs(args.input)
+    elif os.path.isfile(args.input):
+        inputs = videoInputs(args.input)
+    else:
+        sys.exit("No such input: {}".format(args.input))
+
+    classify = loadClassifier()
+    userStore = UserStore(args.userDb)
+
+    def mailFor(identity):
+        if identity is None or identity == -1:
+            return UNKNOWN
+        user = userStore.get(identity)
+        return user['mail'] if user is not None else str(identity)
+
+    align = openface.AlignDlib(args.dlibFacePredictor)
+    net = openface.TorchNeuralNet(args.networkModel, imgDim=args.imgDim, cuda=args.cuda)
+    batcher = EmbeddingBatcher(net, threading.Lock(), maxBatch=args.batchSize,
+                               maxWait=args.batchWait / 1000.0, reportEvery=0)
+    batcher.start()
+    identify = Identifier(align, batcher, classify,
+                          QualityGate() if args.qualityGate else None)
+    pool = ThreadPool(max(1, args.workers))
+    writer = Writer(args.output)
+    evaluation = Evaluation()
+
+    try:
+        # Bounded chunks keep a long video from being decoded into memory
+        # ahead of the workers; results still come out in input order.
+        for chunk in chunks(inputs, 4 * max(1, args.workers) * args.batchSize):
+            for result in pool.map(identify, chunk):
+                actualMail = mailFor(result["actual"]) if result["actual"] else None
+                predictedMail = mailFor(result["identity"])
+                evaluation.add(actualMail, predictedMail, result["status"],
+                               result["latencyMs"])
+                writer.write({
+                    "S.No": evaluation.numInputs,
+                    "ActualMail": actualMail,
+                    "PredictedMail": predictedMail,
+                    "Result": "" if actualMail is None else str(actualMail == predictedMail),
+                    "Source": result["source"],
+                    "Identity": result["identity"],
+                    "Status": result["status"],
+                    "LatencyMs": round(result["latencyMs"], 1)
+                })
+            print("+ Identified {} inputs, {:.1f}/sec".format(
+                evaluation.numInputs,
+                evaluation.numInputs / max(time.time() - evaluation.start, 1e-9)))
+    finally:
+        pool.close()
+        pool.join()
+        batcher.stop()
+        writer.close()
+        userStore.close()
+
+    summary = evaluation.summary(batcher.stats())
+    print(json.dumps(summary, indent=2, sort_keys=True))
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    if args.stubModels:
+        import stub_models as openface
+    else:
+        import openface
+    main()
@@ -0,0 +1,156 @@
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+class _Request:
+
+    def __init__(self, face):
+        self.face = face
+        self.enqueued = time.time()
+        self.done = threading.Event()
+        self.rep = None
+        self.error = None
+
+
+class EmbeddingBatcher:
+    """Collects aligned faces from every session and embeds them in batches.
+
+    A batch is flushed once it holds maxBatch faces or its oldest face has
+    waited maxWait seconds. Callers block in forward() until their own
+    embedding is back, so each session gets exactly the rep it asked for.
+    A net without forwardBatch embeds one face at a time anyway, so then
+    faces are never held back to fill a batch.
+    """
+
+    def __init__(self, net, lock, maxBatch=8, maxWait=0.01, reportEvery=100,
+                 metrics=None):
+        self.net = net
+        self.lock = lock
+        self.maxBatch = max(1, maxBatch)
+        self.maxWait = maxWait
+        self.reportEvery = reportEvery
+        self.metrics = metrics
+        self.requests = queue.Queue()
+        self.thread = None
+        self.running = False
+
+        self.statsLock = threading.Lock()
+        self.numBatches = 0
+        self.numFaces = 0
+        self.batchSizes = {}
+        self.totalWait = 0.0
+        self.maxQueueWait = 0.0
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='embedding-batcher')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.requests.put(None)
+
+    def forward(self, alignedFace):
+        req = _Request(alignedFace)
+        self.requests.put(req)
+        req.done.wait()
+        if req.error is not None:
+            raise req.error
+        return req.rep
+
+    def stats(self):
+        with self.statsLock:
+            return {
+                "batches": self.numBatches,
+                "faces": self.numFaces,
+                "meanBatchSize": float(self.numFaces) / max(1, self.numBatches),
+                "batchSizes": dict(self.batchSizes),
+                "meanQueueWaitMs": 1000.0 * self.totalWait / max(1, self.numFaces),
+                "maxQueueWaitMs": 1000.0 * self.maxQueueWait
+            }
+
+    def _collect(self):
+        first = self.requests.get()
+        if first is None:
+            return []
+        batch = [first]
+        maxWait = self.maxWait if hasattr(self.net, 'forwardBatch') else 0
+        deadline = first.enqueued + maxWait
+        while len(batch) < self.maxBatch:
+            remaining = deadline - time.time()
+            try:
+                if remaining <= 0:
+                    req = self.requests.get_nowait()
+                else:
+                    req = self.requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if req is None:
+                self.running = False
+                break
+            batch.append(req)
+        return batch
+
+    def _forwardBatch(self, faces):
+        # openface's TorchNeuralNet only exposes a per-image forward; use a
+        # batched entry point when the network provides one.
+        forwardBatch = getattr(self.net, 'forwardBatch', None)
+        if forwardBatch is not None:
+            return list(forwardBatch(faces))
+        reps = []
+        for face in faces:
+            try:
+                reps.append(self.net.forward(face))
+            except AssertionError as e:
+                reps.append(e)
+        return reps
+
+    def _record(self, batch, started):
+        with self.statsLock:
+            self.numBatches += 1
+            self.numFaces += len(batch)
+            self.batchSizes[len(batch)] = self.batchSizes.get(len(batch), 0) + 1
+            for req in batch:
+                wait = started - req.enqueued
+                self.totalWait += wait
+                self.maxQueueWait = max(self.maxQueueWait, wait)
+                if self.metrics is not None:
+                    self.metrics.observe('batch_wait', 1000.0 * wait)
+            report = self.reportEvery and self.numBatches % self.reportEvery == 0
+        if report:
+            print("+ Embedding batches: {}".format(self.stats()))
+
+    def _run(self):
+        while self.running:
+            batch = self._collect()
+            if not batch:
+                break
+            # Every caller is blocked in forward(), so each event is set even
+            # if recording or forwarding this batch fails, and the thread
+            # lives on to serve the next batch.
+            reps = []
+            try:
+                started = time.time()
+                self._record(batch, started)
+                with self.lock:
+                    reps = self._forwardBatch([req.face for req in batch])
+                if self.metrics is not None:
+                    perFace = 1000.0 * (time.time() - started) / len(batch)
+                    for _ in batch:
+                        self.metrics.observe('forward', perFace)
+            except Exception as e:
+                reps = [e] * len(batch)
+            finally:
+                for i, req in enumerate(batch):
+                    rep = reps[i] if i < len(reps) else RuntimeError("embedding batch failed")
+                    if isinstance(rep, Exception):
+                        req.error = rep
+                    else:
+                        req.rep = rep
+                    req.done.set()
@@ -0,0 +1,349 @@
+#!/usr/bin/env python2
+"""Load generator for websocket-server.py.
+
+Runs N simulated kiosks against a server, speaking the same protocol as
+js/openface-demo.js (NULL keepalives, INFO, FRAME / TESTING, STOPPED_ACK,
+FEEDBACK), and reports throughput and p50/p95/p99 round-trip latency per
+message type. Results are saved as JSON tagged with the git commit so runs
+can be compared with --compare.
+
+To benchmark without the model files, start the server with the stub
+models, e.g.
+
+    ./websocket-server.py --stubModels --classifier knn --port 9000
+    ./benchmark.py --clients 8 --scenario mixed --out bench.json
+"""
+
+from __future__ import print_function
+
+import argparse
+import base64
+import collections
+import glob
+import json
+import os
+import struct
+import subprocess
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import txaio
+txaio.use_twisted()
+
+from autobahn.twisted.websocket import WebSocketClientProtocol, \
+    WebSocketClientFactory, connectWS
+from twisted.internet import reactor, ssl, task
+
+fileDir = os.path.dirname(os.path.realpath(__file__))
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--url', type=str, default='wss://localhost:9000',
+                    help='WebSocket server to load')
+parser.add_argument('--clients', type=int, default=4,
+                    help='Number of simulated kiosks')
+parser.add_argument('--scenario', type=str, choices=['enroll', 'test', 'mixed'],
+                    default='test',
+                    help='Enroll new users, recognize, or alternate between clients')
+parser.add_argument('--duration', type=float, default=30,
+                    help='Seconds each client streams frames')
+parser.add_argument('--rate', type=float, default=4,
+                    help='Frames per second each client tries to send')
+parser.add_argument('--maxInFlight', type=int, default=1,
+                    help='Unacknowledged frames allowed per client (the web client uses 1)')
+parser.add_argument('--frames', type=str, default=None,
+                    help='Directory of recorded JPEG frames (synthetic frames if omitted)')
+parser.add_argument('--followRate', action='store_true',
+                    help='Adopt the frame interval from RATE messages, as the web client does')
+parser.add_argument('--binary', action='store_true',
+                    help='Send frames with the binary frame protocol')
+parser.add_argument('--nulls', type=int, default=20,
+                    help='NULL round trips before streaming, as the web client does')
+parser.add_argument('--out', type=str, default=None,
+                    help='Write results as JSON to this file')
+parser.add_argument('--compare', type=str, default=None,
+                    help='Earlier results JSON to compare this run against')
+parser.add_argument('--label', type=str, default='',
+                    help='Free-form label stored with the results')
+
+
+def syntheticFrames(n=30, width=400, height=300):
+    """A bright face-like ellipse drifting over a noisy background."""
+    rng = np.random.RandomState(0)
+    frames = []
+    for i in range(n):
+        img = rng.randint(0, 60, (height, width, 3)).astype(np.uint8)
+        center = (width // 2 + int(20 * np.sin(i / 5.0)), height // 2)
+        cv2.ellipse(img, center, (70, 90), 0, 0, 360, (150, 170, 200), -1)
+        cv2.circle(img, (center[0] - 25, center[1] - 20), 8, (40, 40, 40), -1)
+        cv2.circle(img, (center[0] + 25, center[1] - 20), 8, (40, 40, 40), -1)
+        ok, jpeg = cv2.imencode('.jpg', img, [int(cv2.IMWRITE_JPEG_QUALITY), 60])
+        frames.append(jpeg.tostring())
+    return frames
+
+
+def recordedFrames(path):
+    frames = []
+    for f in sorted(glob.glob(os.path.join(path, '*.jp*g'))):
+        with open(f, 'rb') as fp:
+            frames.append(fp.read())
+    if not frames:
+        sys.exit("No JPEG frames found in {}".format(path))
+    return frames
+
+
+def percentile(sortedValues, q):
+    if not sortedValues:
+        return None
+    i = min(len(sortedValues) - 1, int(round(q / 100.0 * (len(sortedValues) - 1))))
+    return sortedValues[i]
+
+
+class Stats:
+
+    def __init__(self):
+        self.latencies = collections.defaultdict(list)
+        self.sent = collections.Counter()
+        self.replies = collections.Counter()
+        self.start = time.time()
+        self.end = None
+
+    def summary(self):
+        elapsed = (self.end or time.time()) - self.start
+        types = {}
+        for msgType in sorted(set(self.sent) | set(self.latencies)):
+            values = sorted(1000.0 * v for v in self.latencies[msgType])
+            types[msgType] = {
+                "sent": self.sent[msgType],
+                "completed": len(values),
+                "throughput": len(values) / elapsed,
+                "meanMs": sum(values) / len(values) if values else None,
+                "p50Ms": percentile(values, 50),
+                "p95Ms": percentile(values, 95),
+                "p99Ms": percentile(values, 99)
+            }
+        return {"elapsed": elapsed, "types": types, "replies": dict(self.replies)}
+
+
+class BenchClientProtocol(WebSocketClientProtocol):
+
+    def onOpen(self):
+        self.pending = collections.defaultdict(collections.deque)
+        self.nulls = 0
+        self.frameIdx = self.factory.index
+        self.streaming = None
+        self.enroll = self.factory.scenario == 'enroll'
+        self.send('NULL', {'type': 'NULL'}, 'NULL')
+
+    def send(self, msgType, msg, reply=None, payload=None):
+        if reply is not None:
+            self.pending[reply].append((msgType, time.time()))
+        self.factory.stats.sent[msgType] += 1
+        if payload is not None:
+            self.sendMessage(payload, isBinary=True)
+        else:
+            self.sendMessage(json.dumps(msg).encode('utf8'))
+
+    def received(self, reply):
+        if self.pending[reply]:
+            msgType, sentAt = self.pending[reply].popleft()
+            self.factory.stats.latencies[msgType].append(time.time() - sentAt)
+
+    def startStreaming(self):
+        self.streamEnd = time.time() + self.factory.duration
+        self.streaming = task.LoopingCall(self.sendNextFrame)
+        self.streaming.start(1.0 / self.factory.rate)
+
+    def sendNextFrame(self):
+        if time.time() >= self.streamEnd:
+            self.streaming.stop()
+            self.streaming = None
+            self.finishStreaming()
+            return
+        if len(self.pending['PROCESSED']) >= self.factory.maxInFlight:
+            return
+        frames = self.factory.frames
+        jpeg = frames[self.frameIdx % len(frames)]
+        self.frameIdx += 1
+        msgType = 'FRAME' if self.enroll else 'TESTING'
+        header = {'type': msgType, 'identity': -1, 'ID': 0}
+        if self.factory.binary:
+            h = json.dumps(header).encode('utf8')
+            self.send(msgType, None, 'PROCESSED',
+                      payload=struct.pack('>H', len(h)) + h + jpeg)
+        else:
+            header['dataURL'] = 'data:image/jpeg;base64,' + \
+                base64.b64encode(jpeg).decode('ascii')
+            self.send(msgType, header, 'PROCESSED')
+
+    def finishStreaming(self):
+        if self.pending['PROCESSED']:
+            reactor.callLater(0.05, self.finishStreaming)
+        elif self.enroll:
+            self.send('STOPPED_ACK', {'type': 'STOPPED_ACK'}, 'STORED_PAGE2')
+        else:
+            self.send('FEEDBACK', {'type': 'FEEDBACK', 'value': True,
+                                   'actualID': 'bench@example.com'})
+            reactor.callLater(0.5, self.sendClose)
+
+    def onMessage(self, payload, isBinary):
+        msg = json.loads(payload.decode('utf8'))
+        self.factory.stats.replies[msg['type']] += 1
+        if msg['type'] == 'NULL':
+            self.received('NULL')
+            self.nulls += 1
+            if self.nulls < self.factory.nulls:
+                self.send('NULL', {'type': 'NULL'}, 'NULL')
+            elif self.enroll:
+                self.send('INFO', {'type': 'INFO', 'name': 'Bench User',
+                                   'mail': 'bench@example.com',
+                                   'mobile': '9999999999',
+                                   'company': 'Bench'}, 'END_FACE_COLLECTION')
+            else:
+                self.startStreaming()
+        elif msg['type'] == 'END_FACE_COLLECTION':
+            self.received('END_FACE_COLLECTION')
+            self.startStreaming()
+        elif msg['type'] == 'PROCESSED' and msg.get('dropped'):
+            # The server replaced our newest waiting frame with the one
+            # sent after it; the frame in progress is still pending.
+            self.factory.stats.replies['DROPPED'] += 1
+            pending = self.pending['PROCESSED']
+            if len(pending) >= 2:
+                del pending[-2]
+        elif msg['type'] == 'PROCESSED':
+            self.received('PROCESSED')
+        elif msg['type'] == 'RATE':
+            if self.factory.followRate and self.streaming is not None:
+                self.streaming.stop()
+                self.streaming.start(msg['interval'] / 1000.0, now=False)
+        elif msg['type'] == 'STORED_PAGE2':
+            self.received('STORED_PAGE2')
+            self.sendClose()
+        elif msg['type'] == 'STORE_FAILED':
+            # Counted in replies; the STORED_PAGE2 it stands for never comes.
+            self.sendClose()
+
+    def onClose(self, wasClean, code, reason):
+        if self.streaming is not None:
+            self.streaming.stop()
+        self.factory.done(self.factory.index)
+
+
+class BenchClientFactory(WebSocketClientFactory):
+    protocol = BenchClientProtocol
+
+    def __init__(self, url, index, runner, args, frames):
+        WebSocketClientFactory.__init__(self, url)
+        self.index = index
+        self.runner = runner
+        self.stats = runner.stats
+        self.frames = frames
+        self.duration = args.duration
+        self.rate = args.rate
+        self.maxInFlight = args.maxInFlight
+        self.binary = args.binary
+        self.followRate = args.followRate
+        self.nulls = args.nulls
+        if args.scenario == 'mixed':
+            self.scenario = 'enroll' if index % 2 == 0 else 'test'
+        else:
+            self.scenario = args.scenario
+
+    def done(self, index):
+        self.runner.clientDone(index)
+
+    def clientConnectionFailed(self, connector, reason):
+        print("Client {} could not connect: {}".format(self.index, reason.getErrorMessage()))
+        self.runner.clientDone(self.index)
+
+
+class Runner:
+
+    def __init__(self, args):
+        self.args = args
+        self.stats = Stats()
+        self.remaining = set(range(args.clients))
+
+    def start(self):
+        frames = recordedFrames(self.args.frames) if self.args.frames else syntheticFrames()
+        contextFactory = ssl.ClientContextFactory()
+        for i in range(self.args.clients):
+            factory = BenchClientFactory(self.args.url, i, self, self.args, frames)
+            if factory.isSecure:
+                connectWS(factory, contextFactory)
+            else:
+                connectWS(factory)
+        # Give up on clients that never finish.
+        reactor.callLater(self.args.duration + 60, self.finish)
+
+    def clientDone(self, index):
+        self.remaining.discard(index)
+        if not self.remaining:
+            self.finish()
+
+    def finish(self):
+        if self.stats.end is None:
+            self.stats.end = time.time()
+            reactor.stop()
+
+
+def gitCommit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=fileDir).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def fmt(v):
+    return '-' if v is None else '{:.1f}'.format(v)
+
+
+def printSummary(results, baseline=None):
+    print("\n{:<14}{:>8}{:>10}{:>10}{:>10}{:>10}".format(
+        'type', 'done', 'msg/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for msgType, r in sorted(results['types'].items()):
+        print("{:<14}{:>8}{:>10}{:>10}{:>10}{:>10}".format(
+            msgType, r['completed'], fmt(r['throughput']),
+            fmt(r['p50Ms']), fmt(r['p95Ms']), fmt(r['p99Ms'])))
+        old = (baseline or {}).get('types', {}).get(msgType)
+        if old:
+            deltas = []
+            for key in ('throughput', 'p50Ms', 'p95Ms', 'p99Ms'):
+                if r[key] is None or old[key] is None:
+                    deltas.append('-')
+                else:
+                    deltas.append('{:+.1f}'.format(r[key] - old[key]))
+            print("{:<14}{:>8}{:>10}{:>10}{:>10}{:>10}".format(
+                '  vs ' + str(baseline.get('commit')), '', *deltas))
+
+
+def main():
+    args = parser.parse_args()
+    runner = Runner(args)
+    reactor.callWhenRunning(runner.start)
+    reactor.run()
+
+    results = runner.stats.summary()
+    results.update({
+        "label": args.label,
+        "commit": gitCommit(),
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "config": vars(args)
+    })
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    printSummary(results, baseline)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print("\nSaved results to {}".format(args.out))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+import os
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import cv2
+
+
+def fsyncDir(d):
+    """Make renames and new entries in directory d durable."""
+    fd = os.open(d, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class _Task:
+
+    def __init__(self, f, args):
+        self.f = f
+        self.args = args
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        """Block until the task ran; return its result or re-raise its error."""
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class CaptureWriter:
+    """Write-behind writer for enrollment images.
+
+    write() only queues the image; a background thread drains the bounded
+    queue in batches, encodes the JPEGs and writes and fsyncs them. When
+    the disk falls behind, write() blocks once maxQueue images are pending
+    instead of letting memory grow. submit() queues any other filesystem
+    step behind the writes before it and returns a task whose wait()
+    re-raises the step's error, and flush() returns once everything queued
+    so far is durably on disk.
+    """
+
+    def __init__(self, maxQueue=256, batchSize=8):
+        self.batchSize = max(1, batchSize)
+        self.items = queue.Queue(maxsize=maxQueue)
+        self.thread = None
+        self.numWritten = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='capture-writer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.flush()
+        self.items.put(None)
+
+    def write(self, path, image):
+        self.items.put(('write', path, image))
+
+    def submit(self, f, *args):
+        task = _Task(f, args)
+        self.items.put(('call', task))
+        return task
+
+    def flush(self):
+        done = threading.Event()
+        self.items.put(('flush', done))
+        done.wait()
+
+    def _writeBatch(self, batch):
+        files = []
+        dirs = set()
+        for path, image in batch:
+            ok, jpeg = cv2.imencode('.jpeg', image)
+            if not ok:
+                print("Could not encode capture {}".format(path))
+                continue
+            d = os.path.dirname(path)
+            try:
+                if d not in dirs and not os.path.exists(d):
+                    os.makedirs(d)
+                dirs.add(d)
+                f = open(path, 'wb')
+                f.write(jpeg.tostring())
+                files.append(f)
+            except (IOError, OSError) as e:
+                print("Could not write capture {}: {}".format(path, e))
+        for f in files:
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+        for d in dirs:
+            fsyncDir(d)
+        self.numWritten += len(files)
+
+    def _run(self):
+        while True:
+            items = [self.items.get()]
+            while len(items) < self.batchSize:
+                try:
+                    items.append(self.items.get_nowait())
+                except queue.Empty:
+                    break
+            writes = []
+            for item in items:
+                if item is None:
+                    self._writeBatch(writes)
+                    return
+                if item[0] == 'write':
+                    writes.append(item[1:])
+                    continue
+                # Keep order: anything else waits for the writes before it.
+                self._writeBatch(writes)
+                writes = []
+                if item[0] == 'flush':
+                    item[1].set()
+                else:
+                    task = item[1]
+                    try:
+                        task.result = task.f(*task.args)
+                    except Exception as e:
+                        print("Capture writer task failed: {}".format(e))
+                        task.error = e
+                    finally:
+                        task.done.set()
+            self._writeBatch(writes)
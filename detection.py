@@ -0,0 +1,85 @@
+import time
+
+import cv2
+import numpy as np
+
+
+def largestBox(bbs):
+    if len(bbs) == 0:
+        return None
+    return max(bbs, key=lambda rect: rect.width() * rect.height())
+
+
+def shiftBox(bb, dx, dy, scale=1.0):
+    return type(bb)(int((bb.left() + dx) / scale), int((bb.top() + dy) / scale),
+                    int((bb.right() + dx) / scale), int((bb.bottom() + dy) / scale))
+
+
+class FaceDetector:
+    """One session's face detection stage.
+
+    With scale < 1 the detector searches a downscaled copy of the frame and
+    the boxes are mapped back to full resolution. With roiPadding > 0 it
+    first searches only the previous face's box grown by roiPadding times
+    its size on every side, and falls back to the whole frame when nothing
+    is found there. Every fullEvery-th frame is searched in full regardless,
+    so a second person elsewhere is noticed within that many frames.
+    """
+
+    def __init__(self, align, scale=1.0, roiPadding=0.0, fullEvery=10):
+        self.align = align
+        self.scale = scale
+        self.roiPadding = roiPadding
+        self.fullEvery = max(1, fullEvery)
+        self.previous = None
+        self.lastMs = 0.0
+        self.totalMs = 0.0
+        self.numFrames = 0
+        self.roiHits = 0
+
+    def _search(self, img, dx=0, dy=0):
+        scale = self.scale
+        if scale != 1.0:
+            img = cv2.resize(img, None, fx=scale, fy=scale,
+                             interpolation=cv2.INTER_AREA)
+            dx, dy = dx * scale, dy * scale
+        bbs = self.align.getAllFaceBoundingBoxes(img)
+        return [shiftBox(bb, dx, dy, scale) for bb in bbs]
+
+    def _roi(self, frame):
+        bb = self.previous
+        pad = int(self.roiPadding * max(bb.width(), bb.height()))
+        height, width = frame.shape[:2]
+        left, top = max(0, bb.left() - pad), max(0, bb.top() - pad)
+        right, bottom = min(width, bb.right() + pad), min(height, bb.bottom() + pad)
+        if right <= left or bottom <= top:
+            return None
+        return (left, top, np.ascontiguousarray(frame[top:bottom, left:right]))
+
+    def detect(self, frame):
+        """All face boxes in frame, in full-resolution coordinates."""
+        start = time.time()
+        bbs = []
+        fullScan = self.numFrames % self.fullEvery == 0
+        if self.roiPadding > 0 and self.previous is not None and not fullScan:
+            roi = self._roi(frame)
+            if roi is not None:
+                left, top, crop = roi
+                bbs = self._search(crop, left, top)
+                if bbs:
+                    self.roiHits += 1
+        if not bbs:
+            bbs = self._search(frame)
+        self.previous = largestBox(bbs)
+        self.lastMs = 1000.0 * (time.time() - start)
+        self.totalMs += self.lastMs
+        self.numFrames += 1
+        return bbs
+
+    def stats(self):
+        return {
+            "frames": self.numFrames,
+            "lastMs": self.lastMs,
+            "meanMs": self.totalMs / max(1, self.numFrames),
+            "roiHits": self.roiHits
+        }
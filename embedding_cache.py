@@ -0,0 +1,113 @@
+import hashlib
+import os
+import pickle
+import threading
+
+
+def fileDigest(path):
+    with open(path, 'rb') as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+# Recorded for an image the network rejected, so it is not retried on every
+# retrain.
+REJECTED = ''
+
+
+class EmbeddingCache:
+    """On-disk record of the phash of each image under training_images/.
+
+    Entries are keyed by image path and validated against the file's mtime
+    and size. When those changed, the content digest decides whether the
+    entry still holds. The reps themselves are kept in the saved
+    GalleryStore under their phash, so loading this file stays cheap.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.dirty = False
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            try:
+                with open(path, 'rb') as f:
+                    self.entries = pickle.load(f)
+            except Exception as e:
+                print("Ignoring unreadable embedding cache {}: {}".format(path, e))
+                self.entries = {}
+        # Caches written before reps moved to the gallery store still hold them.
+        for entry in self.entries.values():
+            rep = entry.pop('rep', False)
+            if rep is not False:
+                if rep is None:
+                    entry['phash'] = REJECTED
+                self.dirty = True
+
+    def __len__(self):
+        return len(self.entries)
+
+    def items(self):
+        """Snapshot of the (path, entry) pairs, safe against concurrent puts."""
+        with self.lock:
+            return list(self.entries.items())
+
+    def lookup(self, imgPath):
+        """Return the phash recorded for imgPath (REJECTED if the network
+        rejected it), or None on a miss."""
+        try:
+            st = os.stat(imgPath)
+        except OSError:
+            self.evict(imgPath)
+            return None
+        with self.lock:
+            entry = self.entries.get(imgPath)
+        if entry is None:
+            return None
+        if entry['mtime'] != st.st_mtime or entry['size'] != st.st_size:
+            if entry['digest'] != fileDigest(imgPath):
+                return None
+            with self.lock:
+                entry['mtime'] = st.st_mtime
+                entry['size'] = st.st_size
+                self.dirty = True
+        return entry['phash']
+
+    def put(self, imgPath, phash):
+        st = os.stat(imgPath)
+        entry = {
+            'mtime': st.st_mtime,
+            'size': st.st_size,
+            'digest': fileDigest(imgPath),
+            'phash': REJECTED if phash is None else phash
+        }
+        with self.lock:
+            self.entries[imgPath] = entry
+            self.dirty = True
+
+    def evict(self, imgPath):
+        with self.lock:
+            if self.entries.pop(imgPath, None) is not None:
+                self.dirty = True
+
+    def retainOnly(self, imgPaths):
+        """Evict every entry whose path is not in imgPaths."""
+        imgPaths = set(imgPaths)
+        with self.lock:
+            stale = [p for p in self.entries if p not in imgPaths]
+            for p in stale:
+                del self.entries[p]
+            if stale:
+                self.dirty = True
+        if stale:
+            print("+ Evicted {} stale embedding cache entries.".format(len(stale)))
+        return len(stale)
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            tmpPath = self.path + '.tmp'
+            with open(tmpPath, 'wb') as f:
+                pickle.dump(self.entries, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmpPath, self.path)
+            self.dirty = False
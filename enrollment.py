@@ -0,0 +1,117 @@
+import multiprocessing
+import os
+import time
+
+import cv2
+import imagehash
+import numpy as np
+from PIL import Image
+
+from embedding_cache import REJECTED
+
+# Each enrollment process loads its own copy of the network once.
+_net = None
+
+
+def _initWorker(networkModel, imgDim, cuda, stub=False):
+    global _net
+    if stub:
+        import stub_models as openface
+    else:
+        import openface
+    _net = openface.TorchNeuralNet(networkModel, imgDim=imgDim, cuda=cuda)
+
+
+def embedImage(net, imgPath):
+    """Read, embed and phash one aligned face; (None, None) if rejected."""
+    alignedFace = cv2.imread(imgPath)
+    try:
+        rep = np.array(net.forward(alignedFace))
+        phash = str(imagehash.phash(Image.fromarray(alignedFace)))
+    except AssertionError:
+        return (None, None)
+    return (rep, phash)
+
+
+def _embedUserDir(job):
+    (identity, imgPaths) = job
+    results = []
+    for imgPath in imgPaths:
+        rep, phash = embedImage(_net, imgPath)
+        results.append((imgPath, rep, phash))
+    return (identity, results)
+
+
+def enrollAll(trainingDir, cache, gallery, netArgs, processes, onFace, onProgress):
+    """Embed the images under trainingDir that gallery does not hold yet.
+
+    Images the cache knows unchanged, and whose phash is already in gallery
+    under the right identity, are not touched; one held under another
+    identity is handed back as onFace(identity, rep, phash). The remaining
+    per-user directories are fanned out over a process pool; each finished
+    directory is written to the cache and handed to onFace() right away,
+    and onProgress(stats) is called after every user. netArgs is the
+    (networkModel, imgDim, cuda, stub) tuple used to load the network in
+    each worker. Returns the final progress stats and the phashes of every
+    image currently under trainingDir.
+    """
+    jobs = []
+    seen = []
+    users = []
+    phashes = set()
+    for fname in sorted(os.listdir(trainingDir)):
+        userDir = os.path.join(trainingDir, fname)
+        if not os.path.isdir(userDir):
+            continue
+        identity = int(fname)
+        users.append(identity)
+        missing = []
+        for i in os.listdir(userDir):
+            imgPath = os.path.join(userDir, i)
+            seen.append(imgPath)
+            phash = cache.lookup(imgPath)
+            if phash == REJECTED:
+                continue
+            known = None if phash is None else gallery.identity(phash)
+            if known is None:
+                missing.append(imgPath)
+                continue
+            phashes.add(phash)
+            if known != identity:
+                onFace(identity, gallery.rep(phash), phash)
+        if missing:
+            jobs.append((identity, missing))
+    cache.retainOnly(seen)
+
+    stats = {
+        "users": len(users),
+        "usersDone": len(users) - len(jobs),
+        "images": len(seen),
+        "embedded": 0,
+        "toEmbed": sum(len(paths) for _, paths in jobs),
+        "imagesPerSec": 0.0
+    }
+    onProgress(dict(stats))
+    if not jobs:
+        cache.save()
+        return (stats, phashes)
+
+    start = time.time()
+    pool = multiprocessing.Pool(processes=max(1, min(processes, len(jobs))),
+                                initializer=_initWorker, initargs=netArgs)
+    try:
+        for identity, results in pool.imap_unordered(_embedUserDir, jobs):
+            for imgPath, rep, phash in results:
+                cache.put(imgPath, phash)
+                if rep is not None:
+                    phashes.add(phash)
+                    onFace(identity, rep, phash)
+            stats["usersDone"] += 1
+            stats["embedded"] += len(results)
+            stats["imagesPerSec"] = stats["embedded"] / max(time.time() - start, 1e-6)
+            onProgress(dict(stats))
+    finally:
+        pool.close()
+        pool.join()
+        cache.save()
+    return (stats, phashes)
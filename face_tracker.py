@@ -0,0 +1,57 @@
+from collections import Counter, deque
+
+try:
+    import dlib
+except ImportError:
+    # Without dlib (e.g. with the stub models) every frame is a full pass.
+    dlib = None
+
+
+class FaceTracker:
+    """Carries one session's face and identity forward between frames.
+
+    After a full detect-and-embed pass the face is followed with dlib's
+    correlation tracker, so the following frames can skip detection and
+    embedding. The tracker is dropped, forcing a full pass, every
+    redetectEvery frames or as soon as its confidence (peak-to-sidelobe
+    ratio) falls below minConfidence. Identities from full passes are
+    smoothed by a majority vote over the last `window` of them.
+    """
+
+    def __init__(self, redetectEvery=5, minConfidence=7.0, window=5):
+        self.redetectEvery = redetectEvery
+        self.minConfidence = minConfidence
+        self.votes = deque(maxlen=max(1, window))
+        self.tracker = None
+        self.identity = -1
+        self.sinceDetect = 0
+        self.tracked = 0
+        self.detected = 0
+
+    def reset(self):
+        self.tracker = None
+        self.votes.clear()
+
+    def track(self, frame):
+        """The face's box in frame, or None when a full pass is needed."""
+        if self.tracker is None or self.sinceDetect + 1 >= self.redetectEvery:
+            return None
+        if self.tracker.update(frame) < self.minConfidence:
+            self.tracker = None
+            return None
+        self.sinceDetect += 1
+        self.tracked += 1
+        pos = self.tracker.get_position()
+        return dlib.rectangle(int(pos.left()), int(pos.top()),
+                              int(pos.right()), int(pos.bottom()))
+
+    def start(self, frame, bb, identity):
+        """Record a full pass; returns the smoothed identity."""
+        self.detected += 1
+        self.sinceDetect = 0
+        if self.redetectEvery > 1 and dlib is not None:
+            self.tracker = dlib.correlation_tracker()
+            self.tracker.start_track(frame, bb)
+        self.votes.append(identity)
+        self.identity = Counter(self.votes).most_common(1)[0][0]
+        return self.identity
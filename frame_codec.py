@@ -0,0 +1,51 @@
+"""Webcam frame decoding for the JSON and binary WebSocket protocols.
+
+A binary frame message is laid out as
+
+    [uint16 big-endian header length][UTF-8 JSON header][JPEG bytes]
+
+where the header carries the same fields as the JSON FRAME/TESTING message
+minus dataURL, e.g. {"type": "TESTING", "identity": -1, "ID": 0}.
+"""
+
+import base64
+import json
+import struct
+
+import cv2
+import numpy as np
+
+DATA_URL_HEAD = "data:image/jpeg;base64,"
+HEADER_LEN = struct.Struct('>H')
+
+
+class EncodedFrame:
+    """A JPEG webcam frame as it arrived: a base64 dataURL or a slice of a
+    binary message payload. decode() is meant to run on a worker thread."""
+
+    def __init__(self, dataURL=None, payload=None, offset=0):
+        self.dataURL = dataURL
+        self.payload = payload
+        self.offset = offset
+
+    def jpegBuffer(self):
+        if self.payload is not None:
+            # Zero-copy view of the JPEG bytes inside the message payload.
+            return np.frombuffer(self.payload, dtype=np.uint8, offset=self.offset)
+        assert(self.dataURL.startswith(DATA_URL_HEAD))
+        return np.frombuffer(base64.b64decode(self.dataURL[len(DATA_URL_HEAD):]),
+                             dtype=np.uint8)
+
+    def decode(self):
+        """The frame as a mirrored BGR ndarray, as the pipeline expects."""
+        bgr = cv2.imdecode(self.jpegBuffer(), cv2.IMREAD_COLOR)
+        assert bgr is not None
+        return cv2.flip(bgr, 1)
+
+
+def parseBinaryFrame(payload):
+    """Split a binary frame message into (header dict, EncodedFrame)."""
+    (n,) = HEADER_LEN.unpack_from(payload, 0)
+    start = HEADER_LEN.size
+    header = json.loads(payload[start:start + n].decode('utf8'))
+    return (header, EncodedFrame(payload=payload, offset=start + n))
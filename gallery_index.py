@@ -0,0 +1,188 @@
+import threading
+
+import numpy as np
+
+
+def kmeans(X, k, iterations=10, seed=0):
+    rng = np.random.RandomState(seed)
+    centroids = X[rng.choice(len(X), k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = squaredDistances(X, centroids).argmin(axis=1)
+        for c in range(k):
+            members = X[assign == c]
+            if len(members):
+                centroids[c] = members.mean(axis=0)
+    return centroids
+
+
+def squaredDistances(Q, X, xNorms=None):
+    if xNorms is None:
+        xNorms = (X * X).sum(axis=1)
+    d = (Q * Q).sum(axis=1)[:, None] - 2.0 * Q.dot(X.T) + xNorms[None, :]
+    return np.maximum(d, 0.0)
+
+
+class EmbeddingIndex:
+    """Nearest-neighbour gallery of OpenFace reps, an alternative to the SVM.
+
+    Reps live in one contiguous float32 matrix that grows by doubling; each
+    row carries an integer identity and is addressed by its image key
+    (the phash). Adding or removing an image is O(1) -- removal moves the
+    last row into the hole. Distances are squared L2 ('l2') or 1 - cosine
+    ('cosine'); a query whose nearest neighbour is further than threshold
+    is reported as -1 (unknown).
+
+    With nlist > 0 an IVF-style coarse quantizer is trained once the gallery
+    holds minPerList * nlist reps, and queries only scan the nprobe closest
+    lists. It is retrained whenever the gallery doubles.
+    """
+
+    def __init__(self, dim=128, metric='l2', threshold=0.99, k=1,
+                 nlist=0, nprobe=4, minPerList=40):
+        self.dim = dim
+        self.metric = metric
+        self.threshold = threshold
+        self.k = k
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.minPerList = minPerList
+
+        self.reps = np.zeros((64, dim), dtype=np.float32)
+        self.norms = np.zeros(64, dtype=np.float32)
+        self.labels = np.zeros(64, dtype=np.int64)
+        self.keys = []
+        self.rows = {}
+        self.size = 0
+
+        self.centroids = None
+        self.lists = None
+        self.assign = np.zeros(64, dtype=np.int64)
+        self.builtSize = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, key):
+        return key in self.rows
+
+    def _grow(self):
+        capacity = 2 * len(self.reps)
+        for name in ('reps', 'norms', 'labels', 'assign'):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def _prepare(self, rep):
+        rep = np.asarray(rep, dtype=np.float32).reshape(-1)
+        if self.metric == 'cosine':
+            rep = rep / max(np.linalg.norm(rep), 1e-12)
+        return rep
+
+    def add(self, key, rep, identity):
+        with self.lock:
+            if key in self.rows:
+                self._remove(key)
+            if self.size == len(self.reps):
+                self._grow()
+            i = self.size
+            self.reps[i] = self._prepare(rep)
+            self.norms[i] = self.reps[i].dot(self.reps[i])
+            self.labels[i] = identity
+            self.keys.append(key)
+            self.rows[key] = i
+            self.size += 1
+            if self.lists is not None:
+                c = int(squaredDistances(self.reps[i:i + 1], self.centroids).argmin())
+                self.assign[i] = c
+                self.lists[c].add(i)
+            self._maybeBuild()
+
+    def remove(self, key):
+        with self.lock:
+            return self._remove(key)
+
+    def _remove(self, key):
+        i = self.rows.pop(key, None)
+        if i is None:
+            return False
+        last = self.size - 1
+        if self.lists is not None:
+            self.lists[self.assign[i]].discard(i)
+        if i != last:
+            self.reps[i] = self.reps[last]
+            self.norms[i] = self.norms[last]
+            self.labels[i] = self.labels[last]
+            self.keys[i] = self.keys[last]
+            self.rows[self.keys[i]] = i
+            if self.lists is not None:
+                self.lists[self.assign[last]].discard(last)
+                self.assign[i] = self.assign[last]
+                self.lists[self.assign[i]].add(i)
+        self.keys.pop()
+        self.size = last
+        return True
+
+    def _maybeBuild(self):
+        if not self.nlist or self.size < self.minPerList * self.nlist:
+            return
+        if self.lists is not None and self.size < 2 * self.builtSize:
+            return
+        X = self.reps[:self.size]
+        self.centroids = kmeans(X, self.nlist)
+        self.assign[:self.size] = squaredDistances(X, self.centroids).argmin(axis=1)
+        self.lists = [set() for _ in range(self.nlist)]
+        for i in range(self.size):
+            self.lists[self.assign[i]].add(i)
+        self.builtSize = self.size
+        print("+ Built IVF gallery index with {} lists over {} reps.".format(
+            self.nlist, self.size))
+
+    def _distances(self, Q, rows):
+        X = self.reps[rows]
+        d = squaredDistances(Q, X, self.norms[rows])
+        if self.metric == 'cosine':
+            # Rows and queries are unit length, so 1 - cos = |q - x|^2 / 2.
+            d = d / 2.0
+        return d
+
+    def search(self, queries, k=None):
+        """Top-k (distances, identities) for a batch of query reps.
+
+        Both arrays have shape (len(queries), k); missing neighbours are
+        padded with inf distance and identity -1.
+        """
+        k = k or self.k
+        Q = np.vstack([self._prepare(q) for q in queries])
+        dists = np.full((len(Q), k), np.inf, dtype=np.float32)
+        ids = np.full((len(Q), k), -1, dtype=np.int64)
+        with self.lock:
+            if self.size == 0:
+                return (dists, ids)
+            if self.lists is None:
+                candidates = [np.arange(self.size)] * len(Q)
+            else:
+                probe = np.argsort(squaredDistances(Q, self.centroids), axis=1)[:, :self.nprobe]
+                candidates = [np.fromiter(set().union(*[self.lists[c] for c in p]), dtype=np.int64)
+                              for p in probe]
+            for qi, rows in enumerate(candidates):
+                if len(rows) == 0:
+                    continue
+                d = self._distances(Q[qi:qi + 1], rows)[0]
+                n = min(k, len(rows))
+                top = np.argpartition(d, n - 1)[:n]
+                top = top[np.argsort(d[top])]
+                dists[qi, :n] = d[top]
+                ids[qi, :n] = self.labels[rows[top]]
+        return (dists, ids)
+
+    def predict(self, rep):
+        """Identity of rep by majority vote of its k neighbours, or -1."""
+        (dists, ids) = self.search([rep])
+        dists, ids = dists[0], ids[0]
+        within = ids[dists <= self.threshold]
+        if len(within) == 0:
+            return -1
+        values, counts = np.unique(within, return_counts=True)
+        return int(values[counts.argmax()])
@@ -0,0 +1,174 @@
+import os
+import threading
+
+import numpy as np
+
+# imagehash.phash() with the default hash size is 16 hex digits.
+PHASH_DTYPE = 'S16'
+SUFFIXES = ('.reps.npy', '.labels.npy', '.phashes.npy')
+
+
+def _key(phash):
+    if isinstance(phash, bytes) and not isinstance(phash, str):
+        return phash.decode('ascii')
+    return str(phash)
+
+
+class GalleryStore:
+    """The reps of one session's images, keyed by phash.
+
+    Reps live in one float32 matrix that grows by doubling, with parallel
+    identity and phash arrays; removal moves the last row into the hole.
+    data() hands out zero-copy (X, y) views for training. The first
+    in-place change after that works on a fresh copy, so views already
+    handed out stay a consistent snapshot while a fit runs.
+
+    save() writes the arrays as .npy files and open() maps them back
+    copy-on-write, so a large gallery opens without being read and its
+    pages are shared by every process that maps it.
+    """
+
+    def __init__(self, dim=128, capacity=64):
+        self.reps = np.zeros((capacity, dim), dtype=np.float32)
+        self.labels = np.zeros(capacity, dtype=np.int64)
+        self.phashes = np.zeros(capacity, dtype=PHASH_DTYPE)
+        self.rows = {}
+        self.size = 0
+        self.exported = False
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, phash):
+        return _key(phash) in self.rows
+
+    def identity(self, phash):
+        i = self.rows.get(_key(phash))
+        return None if i is None else int(self.labels[i])
+
+    def rep(self, phash):
+        i = self.rows.get(_key(phash))
+        return None if i is None else self.reps[i].copy()
+
+    def _grow(self):
+        capacity = max(64, 2 * len(self.reps))
+        for name in ('reps', 'labels', 'phashes'):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+        self.exported = False
+
+    def _detach(self):
+        if self.exported:
+            self.reps = self.reps.copy()
+            self.labels = self.labels.copy()
+            self.exported = False
+
+    def add(self, phash, rep, identity):
+        """Insert or update an image; returns whether anything changed."""
+        key = _key(phash)
+        rep = np.asarray(rep, dtype=np.float32).reshape(-1)
+        with self.lock:
+            i = self.rows.get(key)
+            if i is None:
+                if self.size == len(self.reps):
+                    self._grow()
+                i = self.size
+                self.size += 1
+                self.rows[key] = i
+                self.phashes[i] = key
+            elif self.labels[i] == identity and np.array_equal(self.reps[i], rep):
+                return False
+            else:
+                self._detach()
+            self.reps[i] = rep
+            self.labels[i] = identity
+            self.dirty = True
+            return True
+
+    def setIdentity(self, phash, identity):
+        with self.lock:
+            i = self.rows.get(_key(phash))
+            if i is None:
+                return False
+            self._detach()
+            self.labels[i] = identity
+            self.dirty = True
+            return True
+
+    def remove(self, phash):
+        with self.lock:
+            return self._remove(_key(phash))
+
+    def _remove(self, key):
+        i = self.rows.pop(key, None)
+        if i is None:
+            return False
+        self._detach()
+        last = self.size - 1
+        if i != last:
+            self.reps[i] = self.reps[last]
+            self.labels[i] = self.labels[last]
+            self.phashes[i] = self.phashes[last]
+            self.rows[_key(self.phashes[i])] = i
+        self.size = last
+        self.dirty = True
+        return True
+
+    def retainOnly(self, phashes):
+        """Drop every image whose phash is not in phashes; returns their phashes."""
+        keep = set(_key(p) for p in phashes)
+        with self.lock:
+            stale = [key for key in self.rows if key not in keep]
+            for key in stale:
+                self._remove(key)
+        return stale
+
+    def data(self):
+        """Zero-copy (X, y) views of the reps and identities."""
+        with self.lock:
+            self.exported = True
+            return (self.reps[:self.size], self.labels[:self.size])
+
+    def items(self):
+        """(phash, rep, identity) for every image, as of the call."""
+        (X, y) = self.data()
+        with self.lock:
+            phashes = [_key(p) for p in self.phashes[:len(y)]]
+        return [(phash, X[i], int(y[i])) for i, phash in enumerate(phashes)]
+
+    def save(self, prefix):
+        with self.lock:
+            if not self.dirty:
+                return
+            arrays = (self.reps[:self.size], self.labels[:self.size],
+                      self.phashes[:self.size])
+            for suffix, array in zip(SUFFIXES, arrays):
+                path = prefix + suffix
+                tmpPath = path + '.tmp'
+                with open(tmpPath, 'wb') as f:
+                    np.save(f, array)
+                os.rename(tmpPath, path)
+            self.dirty = False
+
+    @classmethod
+    def open(cls, prefix):
+        """Map a saved gallery copy-on-write; None if there is none."""
+        try:
+            reps, labels, phashes = [np.load(prefix + suffix, mmap_mode='c')
+                                     for suffix in SUFFIXES]
+        except (IOError, ValueError):
+            return None
+        if not (len(reps) == len(labels) == len(phashes)):
+            # Caught between two writes of save(); rebuild instead.
+            return None
+        store = cls(dim=reps.shape[1] if reps.ndim == 2 else 128, capacity=0)
+        if len(reps) == 0:
+            return store
+        store.reps, store.labels, store.phashes = reps, labels, phashes
+        store.size = len(reps)
+        store.rows = dict((_key(p), i) for i, p in enumerate(phashes))
+        return store
@@ -63,6 +63,12 @@ if (tok > 0) {
     var cc = canvas.getContext('2d');
     cc.drawImage(vid, 0, 0, vid.width, vid.height);
     var apx = cc.getImageData(0, 0, vid.width, vid.height);
+    if (useBinaryFrames) {
+        sendBinaryFrame(canvas, test == 1 ? 'TESTING' : 'FRAME');
+        tok--;
+        setTimeout(function() {requestAnimFrame(sendFrameLoop)}, frameInterval);
+        return;
+    }
     var dataURL = canvas.toDataURL('image/jpeg', 0.6);
     if(test == 1){
         var msg = {
@@ -84,7 +90,58 @@ if (tok > 0) {
     socket.send(JSON.stringify(msg));
     tok--;
 }
-setTimeout(function() {requestAnimFrame(sendFrameLoop)}, 250);
+setTimeout(function() {requestAnimFrame(sendFrameLoop)}, frameInterval);
+}
+
+// Milliseconds between frames; the server adjusts it with RATE messages.
+var frameInterval = 250;
+
+// Binary frame: [uint16 header length][JSON header][JPEG bytes], which
+// skips the base64 dataURL on both ends. See frame_codec.py. Off until the
+// server's READY message says it wants them (websocket-server --binaryFrames).
+var useBinaryFrames = false;
+
+function sendBinaryFrame(canvas, type) {
+    var header = new TextEncoder().encode(JSON.stringify({
+        'type': type,
+        'identity': defaultPerson,
+        "ID": uniqueId
+    }));
+    var len = new Uint8Array([header.length >> 8, header.length & 0xff]);
+    canvas.toBlob(function(jpeg) {
+        socket.send(new Blob([len, header, jpeg]));
+    }, 'image/jpeg', 0.6);
+}
+
+// Draw the server's face overlay on the current webcam frame. The server
+// works on a mirrored frame, so the video is mirrored here as well.
+function drawAnnotations(j) {
+    var canvas = document.createElement('canvas');
+    canvas.width = j.width;
+    canvas.height = j.height;
+    canvas.style.width = '430px';
+    var cc = canvas.getContext('2d');
+    cc.save();
+    cc.scale(-1, 1);
+    cc.drawImage(vid, -j.width, 0, j.width, j.height);
+    cc.restore();
+    cc.lineWidth = 3;
+    cc.font = "18px sans-serif";
+    for (var i = 0; i < j.faces.length; i++) {
+        var face = j.faces[i];
+        var b = face.box;
+        cc.strokeStyle = "rgb(153, 255, 204)";
+        cc.strokeRect(b[0], b[1], b[2] - b[0], b[3] - b[1]);
+        cc.fillStyle = "rgb(102, 204, 255)";
+        for (var p = 0; p < face.landmarks.length; p++) {
+            cc.beginPath();
+            cc.arc(face.landmarks[p][0], face.landmarks[p][1], 3, 0, 2 * Math.PI);
+            cc.fill();
+        }
+        cc.fillStyle = "rgb(152, 255, 204)";
+        cc.fillText(face.name, b[0], b[1] - 10);
+    }
+    $("#detectedFaces").empty().append(canvas);
 }
 
 function startTrainingAll(){
@@ -255,6 +312,10 @@ function createSocket(address, name) {
         
     } else if (j.type == "PROCESSED") {
         tok++;
+    } else if (j.type == "RATE") {
+        frameInterval = j.interval;
+        console.log("Frame interval " + j.interval + " ms (server latency " +
+                    Math.round(j.latencyMs) + " ms, " + j.dropped + " frames dropped)");
     }  else if(j.type == "STORED_PAGE2"){
         uniqueId = j.id;
         console.log(uniqueId);
@@ -264,13 +325,16 @@ function createSocket(address, name) {
         sendFrameLoop();
         loaded();			
            // window.open("page3.html");
+        }  else if(j.type == "STORE_FAILED") {
+            toastr.error(j.message);
         }  else if(j.type == "WARNING") {
 			$('#submitbtn').attr('disabled',true);
             tok++;
 			numwarning++;
 			if(numwarning == 10){
 				numwarning=0;
-			  toastr.warning("Unable detect a single face");
+			  // Quality rejections carry a reason and a hint for the user.
+			  toastr.warning(j.reason ? j.message : "Unable detect a single face");
 			}
 			if(numwarning == 10 && page3 == true && timeout<45){
 			   timeout = timeout + 5000;
@@ -327,6 +391,21 @@ function createSocket(address, name) {
                 "<img src='" + j['content'] + "' width='430px'></img>"
                 )
 
+        } else if (j.type == "ANNOTATIONS") {
+            drawAnnotations(j);
+        } else if (j.type == "CAPTURE_STATS") {
+            console.log("Captured " + j.captured + " frames, skipped " +
+                        j.duplicates + " near-duplicates");
+        } else if (j.type == "TRAIN_PROGRESS") {
+            console.log("Enrolled " + j.usersDone + "/" + j.users + " users, " +
+                        j.imagesPerSec.toFixed(1) + " images/sec");
+            if (j.usersDone == j.users) {
+                toastr.info("Embedded all " + j.users + " users");
+            }
+        } else if (j.type == "READY") {
+            useBinaryFrames = j.binaryFrames === true;
+            console.log("Server " + (j.ready ? "ready" : (j.error || "warming up")) +
+                        " after " + j.uptime.toFixed(1) + " s");
         } else if (j.type == "TSNE_DATA") {
             BootstrapDialog.show({
                 message: "<img src='" + j['content'] + "' width='100%'></img>"
@@ -0,0 +1,161 @@
+import bisect
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds (ms) of the latency histogram buckets; the last is +Inf.
+BUCKETS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500,
+              1000, 2000, 5000, 10000, 30000, 60000, float('inf'))
+
+
+class Histogram:
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS_MS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, ms):
+        self.counts[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.sum += ms
+        self.max = max(self.max, ms)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile."""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS_MS, self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "meanMs": self.sum / max(1, self.count),
+            "p50Ms": self.quantile(0.50),
+            "p95Ms": self.quantile(0.95),
+            "p99Ms": self.quantile(0.99),
+            "maxMs": self.max
+        }
+
+
+class Metrics:
+    """Thread-safe latency histograms per pipeline stage, plus counters.
+
+    Counters are keyed by a name and an optional label value, e.g.
+    count('messages', 'FRAME'). snapshot() feeds the STATS message and
+    prometheus() the text endpoint.
+    """
+
+    def __init__(self, prefix='openface'):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.counters = {}
+        self.started = time.time()
+
+    def observe(self, stage, ms):
+        with self.lock:
+            hist = self.stages.get(stage)
+            if hist is None:
+                hist = self.stages[stage] = Histogram()
+            hist.observe(ms)
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(stage, 1000.0 * (time.time() - start))
+
+    def count(self, name, label=None, n=1):
+        with self.lock:
+            key = (name, label)
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def snapshot(self):
+        with self.lock:
+            counters = {}
+            for (name, label), value in self.counters.items():
+                if label is None:
+                    counters[name] = value
+                else:
+                    counters.setdefault(name, {})[label] = value
+            return {
+                "uptime": time.time() - self.started,
+                "stages": dict((stage, hist.summary())
+                               for stage, hist in self.stages.items()),
+                "counters": counters
+            }
+
+    def prometheus(self):
+        lines = []
+        name = '{}_stage_latency_ms'.format(self.prefix)
+        with self.lock:
+            lines.append('# TYPE {} histogram'.format(name))
+            for stage in sorted(self.stages):
+                hist = self.stages[stage]
+                cumulative = 0
+                for bound, n in zip(BUCKETS_MS, hist.counts):
+                    cumulative += n
+                    le = '+Inf' if bound == float('inf') else repr(float(bound))
+                    lines.append('{}_bucket{{stage="{}",le="{}"}} {}'.format(
+                        name, stage, le, cumulative))
+                lines.append('{}_sum{{stage="{}"}} {}'.format(name, stage, hist.sum))
+                lines.append('{}_count{{stage="{}"}} {}'.format(name, stage, hist.count))
+            typed = set()
+            for (counter, label) in sorted(self.counters, key=str):
+                metric = '{}_{}_total'.format(self.prefix, counter)
+                if metric not in typed:
+                    lines.append('# TYPE {} counter'.format(metric))
+                    typed.add(metric)
+                value = self.counters[(counter, label)]
+                if label is None:
+                    lines.append('{} {}'.format(metric, value))
+                else:
+                    lines.append('{}{{kind="{}"}} {}'.format(metric, label, value))
+        return '\n'.join(lines) + '\n'
+
+
+class SampledLog:
+    """Buffered logging for the per-frame path.
+
+    Only every sampleEvery-th message of each kind is kept, and kept lines
+    are written out together by flush() instead of one print per frame.
+    Every kept line is tagged with how many messages of its kind were seen
+    so far.
+    """
+
+    def __init__(self, sampleEvery=100, out=None):
+        self.sampleEvery = max(1, sampleEvery)
+        self.out = out
+        self.lock = threading.Lock()
+        self.seen = {}
+        self.lines = []
+
+    def log(self, kind, fmt, *args):
+        with self.lock:
+            n = self.seen.get(kind, 0) + 1
+            self.seen[kind] = n
+            if (n - 1) % self.sampleEvery != 0:
+                return
+            line = fmt.format(*args)
+            if self.sampleEvery > 1:
+                line = '{} [{} x{}]'.format(line, kind, n)
+            self.lines.append(line)
+
+    def flush(self):
+        with self.lock:
+            lines, self.lines = self.lines, []
+        if lines:
+            out = self.out or sys.stdout
+            out.write('\n'.join(lines) + '\n')
+            out.flush()
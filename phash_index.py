@@ -0,0 +1,56 @@
+
+def hammingDistance(a, b):
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """Burkhard-Keller tree over perceptual hashes under Hamming distance.
+
+    Finding whether any stored hash lies within `radius` bits of a query
+    only visits the subtrees whose edge distance is within radius of the
+    query's distance to their parent, instead of every stored hash.
+    """
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, h):
+        if isinstance(h, str):
+            h = int(h, 16)
+        self.size += 1
+        if self.root is None:
+            self.root = (h, {})
+            return
+        node = self.root
+        while True:
+            d = hammingDistance(h, node[0])
+            if d == 0:
+                self.size -= 1
+                return
+            child = node[1].get(d)
+            if child is None:
+                node[1][d] = (h, {})
+                return
+            node = child
+
+    def nearest(self, h, radius):
+        """The distance to the closest stored hash within radius, or None."""
+        if isinstance(h, str):
+            h = int(h, 16)
+        best = None
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            value, children = stack.pop()
+            d = hammingDistance(h, value)
+            if d <= radius and (best is None or d < best):
+                best = d
+                if d == 0:
+                    break
+            for edge, child in children.items():
+                if d - radius <= edge <= d + radius:
+                    stack.append(child)
+        return best
@@ -0,0 +1,88 @@
+import base64
+import io
+
+try:
+    from urllib import quote
+except ImportError:
+    from urllib.parse import quote
+
+import numpy as np
+
+
+def stratifiedSample(y, maxPoints, seed=0):
+    """Indices of at most maxPoints rows, keeping every label's share."""
+    if len(y) <= maxPoints:
+        return np.arange(len(y))
+    rng = np.random.RandomState(seed)
+    keep = []
+    for label in np.unique(y):
+        idx = np.flatnonzero(y == label)
+        n = max(1, int(round(len(idx) * float(maxPoints) / len(y))))
+        keep.append(rng.choice(idx, min(n, len(idx)), replace=False))
+    return np.sort(np.concatenate(keep))
+
+
+def projectTSNE(X, y, maxPoints=2000, exactLimit=500):
+    """2-D t-SNE of (a stratified sample of) the gallery.
+
+    Galleries above exactLimit points use the Barnes-Hut approximation,
+    which is O(n log n) instead of the exact O(n^2) method.
+    """
+    from sklearn.decomposition import PCA
+    from sklearn.manifold import TSNE
+
+    idx = stratifiedSample(y, maxPoints)
+    X, y = X[idx], y[idx]
+    X_pca = PCA(n_components=min(50, X.shape[0], X.shape[1])).fit_transform(X)
+    method = 'exact' if len(X) <= exactLimit else 'barnes_hut'
+    tsne = TSNE(n_components=2, init='random', random_state=0, method=method)
+    return (tsne.fit_transform(X_pca), y)
+
+
+def renderScatter(X_r, y, people):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    import matplotlib.cm as cm
+
+    yVals = list(np.unique(y))
+    colors = cm.rainbow(np.linspace(0, 1, len(yVals)))
+
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    for c, i in zip(colors, yVals):
+        if i == -1:
+            name = "Unknown"
+        elif 0 <= i < len(people):
+            name = people[i]
+        else:
+            name = str(i)
+        ax.scatter(X_r[y == i, 0], X_r[y == i, 1], c=c, label=name)
+    ax.legend()
+
+    imgdata = io.BytesIO()
+    fig.savefig(imgdata, format='png')
+    return 'data:image/png;base64,' + quote(base64.b64encode(imgdata.getvalue()))
+
+
+class ProjectionCache:
+    """The last t-SNE projection of one gallery, keyed by its version.
+
+    The owner bumps the version whenever images or identities change; a
+    request for the current version is answered without recomputing.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.coords = None
+        self.labels = None
+
+    def get(self, version):
+        if version == self.version:
+            return (self.coords, self.labels)
+        return None
+
+    def put(self, version, coords, labels):
+        self.version = version
+        self.coords = coords
+        self.labels = labels
@@ -0,0 +1,72 @@
+import cv2
+
+# What the kiosk tells the user for each rejection reason.
+MESSAGES = {
+    'small': "Please come closer to the camera",
+    'blurry': "Please hold still",
+    'dark': "Please make sure your face is well lit",
+    'bright': "Too much light on your face, please step out of direct light",
+    'pose': "Please look straight at the camera"
+}
+
+# dlib 68-point landmark indices.
+LEFT_EYE_OUTER = 36
+RIGHT_EYE_OUTER = 45
+NOSE_TIP = 30
+
+# Faces are resized to this width before measuring sharpness, so the
+# Laplacian variance does not depend on how close the user stands.
+SHARPNESS_WIDTH = 96
+
+
+class QualityGate:
+    """Rejects detected faces that are not worth aligning and embedding.
+
+    checkFace() looks at the face box only: its size, its mean brightness
+    and its sharpness (variance of the Laplacian). checkPose() needs the
+    landmarks and rejects strong profiles, measured as the nose tip's
+    offset from the midpoint of the outer eye corners relative to the
+    eye distance. Each returns None for a good face or a reason key from
+    MESSAGES. A threshold of 0 disables its check.
+    """
+
+    def __init__(self, minSize=60, minSharpness=40.0, minBrightness=40,
+                 maxBrightness=220, maxYaw=0.35):
+        self.minSize = minSize
+        self.minSharpness = minSharpness
+        self.minBrightness = minBrightness
+        self.maxBrightness = maxBrightness
+        self.maxYaw = maxYaw
+
+    def checkFace(self, frame, bb):
+        if self.minSize and min(bb.width(), bb.height()) < self.minSize:
+            return 'small'
+        height, width = frame.shape[:2]
+        left, top = max(0, bb.left()), max(0, bb.top())
+        right, bottom = min(width, bb.right() + 1), min(height, bb.bottom() + 1)
+        if right <= left or bottom <= top:
+            return 'small'
+        gray = cv2.cvtColor(frame[top:bottom, left:right], cv2.COLOR_BGR2GRAY)
+        brightness = gray.mean()
+        if self.minBrightness and brightness < self.minBrightness:
+            return 'dark'
+        if self.maxBrightness and brightness > self.maxBrightness:
+            return 'bright'
+        if self.minSharpness:
+            scale = float(SHARPNESS_WIDTH) / gray.shape[1]
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            if cv2.Laplacian(gray, cv2.CV_64F).var() < self.minSharpness:
+                return 'blurry'
+        return None
+
+    def checkPose(self, landmarks):
+        if not self.maxYaw:
+            return None
+        (lx, ly), (rx, ry) = landmarks[LEFT_EYE_OUTER], landmarks[RIGHT_EYE_OUTER]
+        eyeDistance = ((rx - lx) ** 2 + (ry - ly) ** 2) ** 0.5
+        if eyeDistance == 0:
+            return 'pose'
+        yaw = abs(landmarks[NOSE_TIP][0] - (lx + rx) / 2.0) / eyeDistance
+        if yaw > self.maxYaw:
+            return 'pose'
+        return None
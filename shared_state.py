@@ -0,0 +1,86 @@
+import os
+import threading
+
+from twisted.internet import task, threads
+from twisted.python import log
+
+
+def fileSignature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime, st.st_size)
+
+
+class SharedState:
+    """Process-wide, read-only state loaded from files and shared by all
+    connections.
+
+    Each entry is loaded once, on first use, and watched afterwards. When
+    its file's inode, mtime or size changes the new value is loaded on a
+    background thread and swapped in with a single reference assignment, so
+    readers always see either the old or the new value, never a half-loaded
+    one. Values must be treated as read-only by callers.
+    """
+
+    def __init__(self):
+        self.loaders = {}
+        self.values = {}
+        self.signatures = {}
+        self.lock = threading.Lock()
+        self.reloading = set()
+        self.watcher = None
+
+    def register(self, name, path, loader):
+        self.loaders[name] = (path, loader)
+
+    def _load(self, name):
+        path, loader = self.loaders[name]
+        signature = fileSignature(path)
+        if signature is None:
+            return (None, None)
+        print("Loading shared {} from {}".format(name, path))
+        return (loader(path), signature)
+
+    def get(self, name):
+        with self.lock:
+            if name in self.values:
+                return self.values[name]
+        value, signature = self._load(name)
+        with self.lock:
+            if name not in self.values:
+                self.values[name] = value
+                self.signatures[name] = signature
+            return self.values[name]
+
+    def publish(self, name, value):
+        """Install a value this process just wrote to the entry's file."""
+        path, _ = self.loaders[name]
+        with self.lock:
+            self.values[name] = value
+            self.signatures[name] = fileSignature(path)
+
+    def reloadIfChanged(self, name):
+        path, _ = self.loaders[name]
+        with self.lock:
+            if name not in self.values or fileSignature(path) == self.signatures[name]:
+                return False
+        value, signature = self._load(name)
+        with self.lock:
+            self.values[name] = value
+            self.signatures[name] = signature
+        return True
+
+    def poll(self):
+        for name in self.loaders:
+            if name in self.reloading:
+                continue
+            self.reloading.add(name)
+            d = threads.deferToThread(self.reloadIfChanged, name)
+            d.addErrback(log.err)
+            d.addBoth(lambda _, name=name: self.reloading.discard(name))
+
+    def startWatching(self, interval):
+        self.watcher = task.LoopingCall(self.poll)
+        self.watcher.start(interval, now=False)
@@ -1,16 +1,188 @@
 from __future__ import print_function
-import BaseHTTPServer
-import SimpleHTTPServer
+import gzip
+import io
+import mimetypes
+import os
+import socket
 import ssl
 import sys
+import threading
+from email.utils import formatdate, parsedate_tz, mktime_tz
+
+try:
+    from BaseHTTPServer import HTTPServer
+    from SimpleHTTPServer import SimpleHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import HTTPServer, SimpleHTTPRequestHandler
+    from socketserver import ThreadingMixIn
 
 
 '''Adopted from https://www.piware.de/2011/01/creating-an-https-server-in-python/'''
 
+# Text assets worth compressing; images and woff fonts are compressed already.
+COMPRESSIBLE = ('.html', '.css', '.js', '.json', '.svg', '.txt', '.map',
+                '.eot', '.ttf', '.otf', '.xml', '.ico')
+# Third-party assets never change in place, so browsers may keep them for a year.
+LONG_CACHE_DIRS = ('vendor',)
+
+
+class GzipCache:
+    """Gzip variants of the text assets under root.
+
+    build() compresses every asset at startup; get() serves the stored copy
+    and recompresses a file whose mtime or size has changed since.
+    """
+
+    def __init__(self, root, minSize=256):
+        self.root = root
+        self.minSize = minSize
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def build(self):
+        numFiles = 0
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if not name.endswith(COMPRESSIBLE):
+                    continue
+                if self.get(path, os.stat(path)) is not None:
+                    numFiles += 1
+        print('precompressed {} assets'.format(numFiles))
+
+    def get(self, path, st):
+        if not path.endswith(COMPRESSIBLE) or st.st_size < self.minSize:
+            return None
+        signature = (st.st_mtime, st.st_size)
+        entry = self.entries.get(path)
+        if entry is None or entry[0] != signature:
+            with open(path, 'rb') as f:
+                data = f.read()
+            buf = io.BytesIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=9, mtime=0) as gz:
+                gz.write(data)
+            body = buf.getvalue()
+            entry = (signature, body if len(body) < len(data) else None)
+            with self.lock:
+                self.entries[path] = entry
+        return entry[1]
+
+
+class CachingRequestHandler(SimpleHTTPRequestHandler):
+    """Serves files with validators, cache headers and gzip variants.
+
+    Responses carry an ETag and Last-Modified, and conditional requests
+    that still match are answered with 304. Files under LONG_CACHE_DIRS get
+    a year-long max-age; everything else is revalidated on each load.
+    Connections are kept alive so a page's assets reuse one TLS session.
+    """
+    protocol_version = 'HTTP/1.1'
+    timeout = 30
+
+    def cacheControl(self, path):
+        relPath = os.path.relpath(path, self.server.root)
+        if relPath.split(os.sep)[0] in LONG_CACHE_DIRS:
+            return 'public, max-age=31536000'
+        return 'no-cache'
+
+    def notModified(self, etags, mtime):
+        ifNoneMatch = self.headers.get('If-None-Match')
+        if ifNoneMatch is not None:
+            tags = [tag.strip() for tag in ifNoneMatch.split(',')]
+            return '*' in tags or any(tag in etags for tag in tags)
+        ifModifiedSince = self.headers.get('If-Modified-Since')
+        if ifModifiedSince is not None:
+            parsed = parsedate_tz(ifModifiedSince)
+            if parsed is not None:
+                return int(mtime) <= mktime_tz(parsed)
+        return False
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if os.path.isdir(path) and self.path.split('?')[0].endswith('/'):
+            path = os.path.join(path, 'index.html')
+        if not os.path.isfile(path):
+            # Directory redirects, listings and 404s. Not every Python's
+            # version of these sets Content-Length, so end the connection.
+            self.close_connection = True
+            return SimpleHTTPRequestHandler.send_head(self)
+
+        st = os.stat(path)
+        etag = '"{:x}-{:x}"'.format(int(st.st_mtime), st.st_size)
+        gzEtag = etag[:-1] + '-gz"'
+        compressible = path.endswith(COMPRESSIBLE)
+        if self.notModified((etag, gzEtag), st.st_mtime):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', self.cacheControl(path))
+            self.end_headers()
+            return None
+
+        body = None
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = self.server.gzipCache.get(path, st)
+        try:
+            f = io.BytesIO(body) if body is not None else open(path, 'rb')
+        except IOError:
+            self.send_error(404, "File not found")
+            return None
+
+        self.send_response(200)
+        self.send_header('Content-Type', mimetypes.guess_type(path)[0] or 'application/octet-stream')
+        if body is not None:
+            self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('ETag', gzEtag)
+        else:
+            self.send_header('Content-Length', str(st.st_size))
+            self.send_header('ETag', etag)
+        if compressible:
+            self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Last-Modified', formatdate(st.st_mtime, usegmt=True))
+        self.send_header('Cache-Control', self.cacheControl(path))
+        self.end_headers()
+        return f
+
+    def copyfile(self, source, outputfile):
+        # socket.sendfile() is zero-copy on plain sockets and falls back to
+        # send() on TLS ones, where the kernel cannot encrypt for us.
+        sendfile = getattr(self.connection, 'sendfile', None)
+        if sendfile is not None and not isinstance(source, io.BytesIO):
+            self.wfile.flush()
+            sendfile(source)
+        else:
+            SimpleHTTPRequestHandler.copyfile(self, source, outputfile)
+
+
+class ThreadingTLSServer(ThreadingMixIn, HTTPServer):
+    """Serves each connection on its own thread, TLS handshake included,
+    so one slow kiosk does not hold up the next connection's accept()."""
+    daemon_threads = True
+
+    def __init__(self, address, handler, certfile, root):
+        HTTPServer.__init__(self, address, handler)
+        self.context = ssl.SSLContext(getattr(ssl, 'PROTOCOL_TLS_SERVER', ssl.PROTOCOL_SSLv23))
+        self.context.load_cert_chain(certfile)
+        self.root = root
+        self.gzipCache = GzipCache(root)
+
+    def finish_request(self, request, client_address):
+        try:
+            conn = self.context.wrap_socket(request, server_side=True)
+        except (ssl.SSLError, socket.error):
+            return
+        try:
+            self.RequestHandlerClass(conn, client_address, self)
+        finally:
+            conn.close()
+
 
 def main(port):
-    httpd = BaseHTTPServer.HTTPServer(('0.0.0.0', port), SimpleHTTPServer.SimpleHTTPRequestHandler)
-    httpd.socket = ssl.wrap_socket(httpd.socket, certfile='tls/server.pem', server_side=True)
+    httpd = ThreadingTLSServer(('0.0.0.0', port), CachingRequestHandler,
+                               'tls/server.pem', os.getcwd())
+    httpd.gzipCache.build()
     print('now serving tls http on port:', port)
     httpd.serve_forever()
 
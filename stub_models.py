@@ -0,0 +1,107 @@
+"""Stand-ins for openface.AlignDlib and openface.TorchNeuralNet.
+
+`websocket-server.py --stubModels` uses this module in place of openface so
+the server can be load-tested without the dlib predictor, the Torch model
+or a Lua runtime. The stubs are cheap, deterministic and image-dependent:
+every frame holds one centred face, and the 128-d rep is a normalized
+thumbnail of the aligned face, so similar frames get similar reps. Set
+OPENFACE_STUB_DETECT_MS / OPENFACE_STUB_FORWARD_MS to emulate model cost.
+"""
+
+import os
+import time
+
+import cv2
+import numpy as np
+
+try:
+    from dlib import rectangle
+except ImportError:
+    class rectangle(object):
+
+        def __init__(self, left, top, right, bottom):
+            self._box = (int(left), int(top), int(right), int(bottom))
+
+        def left(self):
+            return self._box[0]
+
+        def top(self):
+            return self._box[1]
+
+        def right(self):
+            return self._box[2]
+
+        def bottom(self):
+            return self._box[3]
+
+        def width(self):
+            return self._box[2] - self._box[0] + 1
+
+        def height(self):
+            return self._box[3] - self._box[1] + 1
+
+DETECT_SECONDS = float(os.environ.get('OPENFACE_STUB_DETECT_MS', 0)) / 1000.0
+FORWARD_SECONDS = float(os.environ.get('OPENFACE_STUB_FORWARD_MS', 0)) / 1000.0
+
+
+class AlignDlib:
+    INNER_EYES_AND_BOTTOM_LIP = [39, 42, 57]
+    OUTER_EYES_AND_NOSE = [36, 45, 33]
+
+    def __init__(self, facePredictor):
+        self.facePredictor = facePredictor
+
+    def getAllFaceBoundingBoxes(self, rgbImg):
+        assert rgbImg is not None
+        if DETECT_SECONDS:
+            time.sleep(DETECT_SECONDS)
+        height, width = rgbImg.shape[:2]
+        size = min(height, width) // 2
+        if size < 8:
+            return []
+        left, top = (width - size) // 2, (height - size) // 2
+        return [rectangle(left, top, left + size - 1, top + size - 1)]
+
+    def getLargestFaceBoundingBox(self, rgbImg, skipMulti=False):
+        bbs = self.getAllFaceBoundingBoxes(rgbImg)
+        return bbs[0] if bbs else None
+
+    def findLandmarks(self, rgbImg, bb):
+        # 68 points spread over the box, like dlib's predictor output, with
+        # the eye corners and nose placed for a frontal face.
+        xs = np.linspace(bb.left(), bb.right(), 17)
+        ys = np.linspace(bb.top(), bb.bottom(), 4)
+        points = [(int(xs[i % 17]), int(ys[i // 17])) for i in range(68)]
+        cx, w, h = (bb.left() + bb.right()) // 2, bb.width(), bb.height()
+        points[36] = (int(cx - 0.3 * w), int(bb.top() + 0.4 * h))
+        points[45] = (int(cx + 0.3 * w), int(bb.top() + 0.4 * h))
+        points[30] = (cx, int(bb.top() + 0.6 * h))
+        points[33] = (cx, int(bb.top() + 0.65 * h))
+        return points
+
+    def align(self, imgDim, rgbImg, bb=None, landmarks=None,
+              landmarkIndices=INNER_EYES_AND_BOTTOM_LIP, skipMulti=False):
+        if bb is None:
+            bb = self.getLargestFaceBoundingBox(rgbImg)
+            if bb is None:
+                return None
+        face = rgbImg[max(0, bb.top()):bb.bottom() + 1, max(0, bb.left()):bb.right() + 1]
+        if face.size == 0:
+            return None
+        return cv2.resize(face, (imgDim, imgDim))
+
+
+class TorchNeuralNet:
+
+    def __init__(self, model=None, imgDim=96, cuda=False):
+        self.model = model
+        self.imgDim = imgDim
+
+    def forward(self, rgbImg):
+        assert rgbImg is not None
+        if FORWARD_SECONDS:
+            time.sleep(FORWARD_SECONDS)
+        gray = cv2.cvtColor(rgbImg, cv2.COLOR_BGR2GRAY)
+        rep = cv2.resize(gray, (16, 8)).astype(np.float64).reshape(-1)
+        rep -= rep.mean()
+        return rep / max(np.linalg.norm(rep), 1e-12)
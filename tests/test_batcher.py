@@ -0,0 +1,60 @@
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from batcher import EmbeddingBatcher
+from metrics import Metrics
+
+
+class DoublingNet:
+
+    def forward(self, face):
+        return [2 * x for x in face]
+
+
+class EmbeddingBatcherTest(unittest.TestCase):
+
+    def test_forward_round_trip(self):
+        metrics = Metrics()
+        batcher = EmbeddingBatcher(DoublingNet(), threading.Lock(), maxWait=0.001,
+                                   reportEvery=0, metrics=metrics)
+        batcher.start()
+        try:
+            self.assertEqual(batcher.forward([1, 2, 3]), [2, 4, 6])
+        finally:
+            batcher.stop()
+        self.assertEqual(batcher.stats()["faces"], 1)
+        self.assertIn('forward', metrics.snapshot()["stages"])
+
+    def test_no_wait_without_forward_batch(self):
+        batcher = EmbeddingBatcher(DoublingNet(), threading.Lock(), maxWait=5.0,
+                                   reportEvery=0)
+        batcher.start()
+        try:
+            start = time.time()
+            batcher.forward([1])
+            self.assertLess(time.time() - start, 1.0)
+        finally:
+            batcher.stop()
+
+    def test_failed_batch_releases_callers(self):
+        class BrokenMetrics:
+            def observe(self, stage, ms):
+                raise ValueError(stage)
+
+        batcher = EmbeddingBatcher(DoublingNet(), threading.Lock(), maxWait=0.001,
+                                   reportEvery=0, metrics=BrokenMetrics())
+        batcher.start()
+        try:
+            self.assertRaises(ValueError, batcher.forward, [1])
+            self.assertRaises(ValueError, batcher.forward, [2])
+        finally:
+            batcher.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+try:
+    from capture_writer import CaptureWriter
+except ImportError:
+    CaptureWriter = None
+
+
+@unittest.skipIf(CaptureWriter is None, "needs cv2")
+class CaptureWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.writer = CaptureWriter()
+        self.writer.start()
+
+    def tearDown(self):
+        self.writer.stop()
+
+    def test_submit_returns_result(self):
+        self.assertEqual(self.writer.submit(lambda a, b: a + b, 1, 2).wait(), 3)
+
+    def test_failed_task_raises_in_caller(self):
+        d = tempfile.mkdtemp()
+        try:
+            task = self.writer.submit(os.rename, os.path.join(d, 'missing'),
+                                      os.path.join(d, 'target'))
+            self.assertRaises(OSError, task.wait)
+        finally:
+            shutil.rmtree(d)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+try:
+    import numpy as np
+    from sklearn.svm import SVC
+    from training import SVMTrainer
+except ImportError:
+    SVC = None
+
+
+@unittest.skipIf(SVC is None, "needs numpy and sklearn")
+class SVMTrainerTest(unittest.TestCase):
+
+    def test_search_runs_folds_in_parallel_from_a_thread(self):
+        # The server fits on a worker thread, where joblib will not fork.
+        rng = np.random.RandomState(0)
+        X = np.vstack([rng.normal(0, 1, (20, 8)), rng.normal(3, 1, (20, 8))])
+        y = np.array([0] * 20 + [1] * 20)
+        threads = set()
+        fit = SVC.fit
+
+        def recordingFit(svc, *args, **kwargs):
+            threads.add(threading.current_thread().ident)
+            return fit(svc, *args, **kwargs)
+
+        errors = []
+
+        def train():
+            try:
+                SVMTrainer(nJobs=2).fit(X, y)
+            except Exception as e:
+                errors.append(e)
+
+        SVC.fit = recordingFit
+        try:
+            worker = threading.Thread(target=train)
+            worker.start()
+            worker.join()
+        finally:
+            SVC.fit = fit
+        self.assertEqual(errors, [])
+        self.assertGreater(len(threads), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
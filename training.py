@@ -0,0 +1,130 @@
+import threading
+import time
+
+import numpy as np
+
+# sklearn is imported when a model is first fitted, keeping it off the
+# server's startup path.
+
+FULL_GRID = [
+    {'C': [1, 10, 100, 1000],
+     'kernel': ['linear']},
+    {'C': [1, 10, 100, 1000],
+     'gamma': [0.001, 0.0001],
+     'kernel': ['rbf']}
+]
+
+
+def threadedJobs():
+    """Run joblib's parallel loops, such as GridSearchCV's, on threads.
+
+    Fits run on a worker thread, where joblib refuses to start processes
+    and silently falls back to n_jobs=1; libsvm releases the GIL while it
+    trains, so threads do run the folds in parallel.
+    """
+    try:
+        from sklearn.utils import parallel_backend
+    except ImportError:
+        from sklearn.externals.joblib import parallel_backend
+    return parallel_backend('threading')
+
+
+def gridSearchCV():
+    try:
+        from sklearn.model_selection import GridSearchCV
+    except ImportError:
+        from sklearn.grid_search import GridSearchCV
+    return GridSearchCV
+
+
+def neighbourGrid(best):
+    """A small grid around the previously chosen C (and gamma)."""
+    grid = {'kernel': [best['kernel']],
+            'C': [best['C'] / 3.0, best['C'], best['C'] * 3.0]}
+    if best['kernel'] == 'rbf':
+        grid['gamma'] = [best['gamma'] / 3.0, best['gamma'], best['gamma'] * 3.0]
+    return [grid]
+
+
+def subsample(X, y, maxPerIdentity, seed=0):
+    """At most maxPerIdentity samples of every label, for the search only."""
+    if not maxPerIdentity:
+        return (X, y)
+    rng = np.random.RandomState(seed)
+    keep = []
+    for label in np.unique(y):
+        idx = np.flatnonzero(y == label)
+        if len(idx) > maxPerIdentity:
+            idx = rng.choice(idx, maxPerIdentity, replace=False)
+        keep.append(idx)
+    keep = np.sort(np.concatenate(keep))
+    return (X[keep], y[keep])
+
+
+class SVMTrainer:
+    """Fits the recognition SVM, optionally warm-starting from the last fit.
+
+    In 'full' mode every fit runs the whole linear+RBF grid. In 'warm' mode
+    the first fit is a full search; later fits search only a neighbourhood
+    of the previous C/gamma/kernel on a per-identity subsample, or skip the
+    search entirely when the data changed by less than skipFraction.
+    """
+
+    def __init__(self, mode='full', nJobs=-1, maxPerIdentity=50, skipFraction=0.05):
+        self.mode = mode
+        self.nJobs = nJobs
+        self.maxPerIdentity = maxPerIdentity
+        self.skipFraction = skipFraction
+        self.best = None
+        self.lastFull = None
+        self.lastSize = 0
+        self.lastLabels = None
+        self.lock = threading.Lock()
+
+    def changedFraction(self, y):
+        if self.lastLabels is None or set(np.unique(y)) != self.lastLabels:
+            return 1.0
+        return abs(len(y) - self.lastSize) / float(max(1, self.lastSize))
+
+    def search(self, X, y, grid):
+        GridSearchCV = gridSearchCV()
+        from sklearn.svm import SVC
+        minCount = np.bincount(np.unique(y, return_inverse=True)[1]).min()
+        cv = max(2, min(5, minCount))
+        with threadedJobs():
+            return GridSearchCV(SVC(C=1), grid, cv=cv, n_jobs=self.nJobs,
+                                refit=False).fit(X, y)
+
+    def fit(self, X, y):
+        GridSearchCV = gridSearchCV()
+        from sklearn.svm import SVC
+        with self.lock:
+            start = time.time()
+            if self.mode != 'warm' or self.best is None:
+                with threadedJobs():
+                    svm = GridSearchCV(SVC(C=1), FULL_GRID, cv=5,
+                                       n_jobs=self.nJobs).fit(X, y)
+                self.best = svm.best_params_
+                self.lastFull = {'time': time.time() - start,
+                                 'score': svm.best_score_}
+                print("+ Full SVM search: {} (score {:.3f}) in {:.2f}s".format(
+                    self.best, svm.best_score_, self.lastFull['time']))
+            else:
+                score = None
+                if self.changedFraction(y) >= self.skipFraction:
+                    (Xs, ys) = subsample(X, y, self.maxPerIdentity)
+                    search = self.search(Xs, ys, neighbourGrid(self.best))
+                    self.best = search.best_params_
+                    score = search.best_score_
+                svm = SVC(**self.best).fit(X, y)
+                elapsed = time.time() - start
+                if score is None:
+                    print("+ Warm SVM fit: data barely changed, reused {}".format(self.best))
+                else:
+                    print("+ Warm SVM search: {} (score {:.3f}, {:+.3f} vs full search)".format(
+                        self.best, score, score - self.lastFull['score']))
+                print("+ Warm SVM fit took {:.2f}s, {:.2f}s less than the last full search".format(
+                    elapsed, self.lastFull['time'] - elapsed))
+            self.lastSize = len(y)
+            self.lastLabels = set(np.unique(y))
+            return svm
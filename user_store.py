@@ -0,0 +1,136 @@
+import csv
+import os
+import sqlite3
+import threading
+
+USER_FIELDS = ('id', 'name', 'mail', 'mobile', 'company')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    mail TEXT,
+    mobile TEXT,
+    company TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    sno INTEGER PRIMARY KEY AUTOINCREMENT,
+    actual_mail TEXT,
+    predicted_mail TEXT,
+    result TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class UserStore:
+    """User details and feedback results in SQLite, indexed by user ID.
+
+    Users are cached in a dict so recognized frames look them up in O(1);
+    a miss falls through to the database, which picks up users registered
+    by other processes. Writes are queued and committed in one transaction
+    by flush(), which the server calls periodically and on shutdown.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = self._connect()
+        self.lock = threading.Lock()
+        self.users = {}
+        self.pendingUsers = []
+        self.pendingResults = []
+        for row in self.conn.execute("SELECT id, name, mail, mobile, company FROM users"):
+            self.users[row[0]] = dict(zip(USER_FIELDS, row))
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        return conn
+
+    def reopen(self):
+        # SQLite connections must not be used across fork(); a forked
+        # serving process calls this to get its own.
+        with self.lock:
+            self.conn = self._connect()
+
+    def __len__(self):
+        return len(self.users)
+
+    def get(self, userId):
+        key = str(userId)
+        user = self.users.get(key)
+        if user is None:
+            with self.lock:
+                row = self.conn.execute(
+                    "SELECT id, name, mail, mobile, company FROM users WHERE id = ?",
+                    (key,)).fetchone()
+            if row is not None:
+                user = dict(zip(USER_FIELDS, row))
+                self.users[key] = user
+        return user
+
+    def addUser(self, userId, name, mail, mobile, company):
+        user = dict(zip(USER_FIELDS, (str(userId), name, mail, mobile, company)))
+        with self.lock:
+            self.users[user['id']] = user
+            self.pendingUsers.append(tuple(user[f] for f in USER_FIELDS))
+        return user
+
+    def addResult(self, actualMail, predictedMail, result):
+        with self.lock:
+            self.pendingResults.append((actualMail, predictedMail, str(result)))
+
+    def flush(self):
+        with self.lock:
+            if not self.pendingUsers and not self.pendingResults:
+                return
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO users (id, name, mail, mobile, company) "
+                    "VALUES (?, ?, ?, ?, ?)", self.pendingUsers)
+                self.conn.executemany(
+                    "INSERT INTO results (actual_mail, predicted_mail, result) "
+                    "VALUES (?, ?, ?)", self.pendingResults)
+            self.pendingUsers = []
+            self.pendingResults = []
+
+    def importCsv(self, detailsCsv, resultsCsv):
+        """One-shot import of the legacy User_Details.csv and results.csv."""
+        with self.lock:
+            if self.conn.execute("SELECT 1 FROM meta WHERE key = 'csv_imported'").fetchone():
+                return
+        users = []
+        results = []
+        if os.path.exists(detailsCsv):
+            with open(detailsCsv) as f:
+                for row in csv.DictReader(f):
+                    if row.get('ID'):
+                        users.append((row['ID'], row.get('Name'), row.get('Mail'),
+                                      row.get('Number'), row.get('Company')))
+        if os.path.exists(resultsCsv):
+            with open(resultsCsv) as f:
+                for row in csv.DictReader(f):
+                    results.append((row.get('ActualMail'), row.get('PredictedMail'),
+                                    row.get('Result')))
+        with self.lock:
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO users (id, name, mail, mobile, company) "
+                    "VALUES (?, ?, ?, ?, ?)", users)
+                self.conn.executemany(
+                    "INSERT INTO results (actual_mail, predicted_mail, result) "
+                    "VALUES (?, ?, ?)", results)
+                self.conn.execute("INSERT INTO meta (key, value) VALUES ('csv_imported', '1')")
+            for row in users:
+                self.users[row[0]] = dict(zip(USER_FIELDS, row))
+        print("+ Imported {} users and {} results from CSV.".format(len(users), len(results)))
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self.conn.close()
@@ -17,9 +17,15 @@
 import os
 import sys
 import shutil
+import signal
+import socket
 import time
+bootStart = time.time()
 import pickle
 import datetime
+import threading
+import multiprocessing
+from contextlib import contextmanager
 fileDir = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.join(fileDir, "..", ".."))
 
@@ -28,12 +34,17 @@ txaio.use_twisted()
 
 from autobahn.twisted.websocket import WebSocketServerProtocol, \
     WebSocketServerFactory
-from twisted.internet import task, defer
+# The reactor itself is imported in __main__ (or in each forked worker with
+# --processes), so that it is never shared across fork().
+from twisted.internet import task, defer, threads
 from twisted.internet.ssl import DefaultOpenSSLContextFactory
+from twisted.protocols.tls import TLSMemoryBIOFactory
+from twisted.web.resource import Resource
+from twisted.web.server import Site
 
 from twisted.python import log
+from twisted.python.threadpool import ThreadPool
 
-import pandas as pd
 import argparse
 import cv2
 import imagehash
@@ -41,21 +52,24 @@ import json
 from PIL import Image
 import numpy as np
 import os
-import StringIO
-import urllib
-import base64
 
-from sklearn.decomposition import PCA
-from sklearn.grid_search import GridSearchCV
-from sklearn.manifold import TSNE
-from sklearn.svm import SVC
-
-import matplotlib as mpl
-mpl.use('Agg')
-import matplotlib.pyplot as plt
-import matplotlib.cm as cm
-
-import openface
+from batcher import EmbeddingBatcher
+from embedding_cache import EmbeddingCache
+from enrollment import enrollAll
+from training import SVMTrainer
+from gallery_index import EmbeddingIndex
+from gallery_store import GalleryStore
+from shared_state import SharedState, fileSignature
+from user_store import UserStore
+from frame_codec import EncodedFrame, parseBinaryFrame
+from annotation import faceOverlay, drawOverlay, encodeJpeg, encodePng
+from face_tracker import FaceTracker
+from detection import FaceDetector, largestBox
+from quality import QualityGate, MESSAGES as QUALITY_MESSAGES
+from phash_index import BKTree
+from capture_writer import CaptureWriter, fsyncDir
+from projection import ProjectionCache, projectTSNE, renderScatter
+from metrics import Metrics, SampledLog
 
 nameCounter = 0
 modelDir = os.path.join(fileDir, 'models')
@@ -73,36 +87,379 @@ parser.add_argument('--networkModel', type=str, help="Path to Torch network mode
 parser.add_argument('--imgDim', type=int,
                     help="Default image dimension.", default=96)
 parser.add_argument('--cuda', action='store_true')
+parser.add_argument('--stubModels', action='store_true',
+                    help='Use the stand-in models from stub_models.py (for benchmarking '
+                         'without the dlib and Torch model files)')
 parser.add_argument('--unknown', type=bool, default=False,
                     help='Try to predict unknown people')
 parser.add_argument('--port', type=int, default=9000,
                     help='WebSocket Port')
+parser.add_argument('--binaryFrames', action='store_true',
+                    help='Tell clients in READY to send binary FRAME messages '
+                         'instead of base64 dataURLs (both are always accepted)')
+parser.add_argument('--processes', type=int, default=1,
+                    help='Serving processes forked from one supervisor that loads the '
+                         'models once and shares the listening socket (SVM only)')
+parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+                    help='Number of worker threads running the face pipeline')
+parser.add_argument('--batchSize', type=int, default=8,
+                    help='Maximum number of faces embedded in one batch')
+parser.add_argument('--batchWait', type=float, default=10,
+                    help='Maximum time (ms) a face waits for its batch to fill')
+parser.add_argument('--embeddingCache', type=str, default='embedding_cache.pkl',
+                    help='File caching the embeddings of training_images/')
+parser.add_argument('--enrollProcesses', type=int, default=multiprocessing.cpu_count(),
+                    help='Number of processes embedding images in TRAINALLIMAGES')
+parser.add_argument('--retrainDelay', type=float, default=2.0,
+                    help='Quiet period (s) after the last edit before the SVM is retrained')
+parser.add_argument('--svmSearch', type=str, choices=['full', 'warm'], default='full',
+                    help='Search the whole SVM grid on every retrain, or warm-start '
+                         'from the previous parameters')
+parser.add_argument('--cvJobs', type=int, default=-1,
+                    help='Parallel jobs for SVM cross-validation (-1 uses all cores)')
+parser.add_argument('--searchPerIdentity', type=int, default=50,
+                    help='Images per identity used by the warm SVM search (0 for all)')
+parser.add_argument('--classifier', type=str, choices=['svm', 'knn'], default='svm',
+                    help='Recognize with the SVM or a nearest-neighbour gallery index')
+parser.add_argument('--knnMetric', type=str, choices=['l2', 'cosine'], default='l2',
+                    help='Distance used by the nearest-neighbour classifier')
+parser.add_argument('--knnThreshold', type=float, default=0.99,
+                    help='Distance (squared L2 or 1 - cosine) beyond which a face is unknown')
+parser.add_argument('--knnNeighbours', type=int, default=1,
+                    help='Neighbours voting on the identity of a face')
+parser.add_argument('--knnLists', type=int, default=0,
+                    help='Coarse IVF lists for large galleries (0 for exact search)')
+parser.add_argument('--knnProbe', type=int, default=4,
+                    help='IVF lists scanned per query')
+parser.add_argument('--reloadInterval', type=float, default=2.0,
+                    help='How often (s) shared model and user files are checked for changes')
+parser.add_argument('--annotation', type=str, choices=['jpeg', 'json', 'png'], default='jpeg',
+                    help='Send recognized frames as a JPEG, as overlay data for the '
+                         'browser to draw, or as the legacy matplotlib PNG')
+parser.add_argument('--annotationQuality', type=int, default=70,
+                    help='JPEG quality of annotated frames')
+parser.add_argument('--trackEvery', type=int, default=5,
+                    help='Re-detect and re-embed the tracked face every N frames (1 disables tracking)')
+parser.add_argument('--trackConfidence', type=float, default=7.0,
+                    help='Minimum tracker confidence before falling back to detection')
+parser.add_argument('--voteWindow', type=int, default=5,
+                    help='Number of recent identities voting on the reported one')
+parser.add_argument('--detectScale', type=float, default=1.0,
+                    help='Run face detection on the frame downscaled by this factor')
+parser.add_argument('--detectRoiPadding', type=float, default=0.0,
+                    help='Search around the previous face, padded by this fraction of '
+                         'its size, before the whole frame (0 disables)')
+parser.add_argument('--detectFullEvery', type=int, default=10,
+                    help='With --detectRoiPadding, still search the whole frame every '
+                         'this many frames so a second person is noticed')
+parser.add_argument('--minFrameInterval', type=float, default=250,
+                    help='Shortest frame interval (ms) RATE messages ask clients for')
+parser.add_argument('--maxFrameInterval', type=float, default=2000,
+                    help='Longest frame interval (ms) RATE messages ask clients for')
+parser.add_argument('--minFaceSize', type=int, default=60,
+                    help='Reject faces whose box is smaller than this many pixels (0 disables)')
+parser.add_argument('--minSharpness', type=float, default=40.0,
+                    help='Reject faces whose Laplacian variance is below this (0 disables)')
+parser.add_argument('--minBrightness', type=float, default=40,
+                    help='Reject faces darker than this mean gray level (0 disables)')
+parser.add_argument('--maxBrightness', type=float, default=220,
+                    help='Reject faces brighter than this mean gray level (0 disables)')
+parser.add_argument('--maxYaw', type=float, default=0.35,
+                    help='Reject faces turned further than this nose offset over eye '
+                         'distance (0 disables)')
+parser.add_argument('--dupRadius', type=int, default=6,
+                    help='Drop enrollment frames whose phash is within this many bits '
+                         'of one already captured for the user (-1 disables)')
+parser.add_argument('--captureQueue', type=int, default=256,
+                    help='Enrollment images that may wait for the disk before frames block')
+parser.add_argument('--galleryStore', type=str, default='gallery',
+                    help='Prefix of the .npy files the enrolled gallery is saved to '
+                         'and memory-mapped from')
+parser.add_argument('--tsneMaxPoints', type=int, default=2000,
+                    help='Largest gallery sample projected by t-SNE')
+parser.add_argument('--userDb', type=str, default='users.db',
+                    help='SQLite database holding user details and feedback results')
+parser.add_argument('--userFlushInterval', type=float, default=1.0,
+                    help='How often (s) queued user and feedback writes are committed')
+parser.add_argument('--metricsPort', type=int, default=9100,
+                    help='Local port serving Prometheus-style metrics on /metrics and '
+                         'readiness on /ready (0 disables); with --processes, worker i '
+                         'uses metricsPort + i')
+parser.add_argument('--logSample', type=int, default=100,
+                    help='Log one in every N per-frame messages of each kind')
+parser.add_argument('--logFlushInterval', type=float, default=1.0,
+                    help='How often (s) buffered per-frame log lines are written')
 
 args = parser.parse_args()
+if args.classifier == 'knn' and args.processes > 1:
+    # Each worker updates its own gallery index in place on every enrollment,
+    # and nothing carries those changes to the other workers.
+    parser.error("--classifier knn needs --processes 1; only the SVM model "
+                 "is reloaded across workers")
 
-align = openface.AlignDlib(args.dlibFacePredictor)
-net = openface.TorchNeuralNet(args.networkModel, imgDim=args.imgDim,
-                              cuda=args.cuda)
-model_location = 'model.sav'
+# (phase, seconds) of this process's startup, reported with READY.
+startupPhases = [('imports', time.time() - bootStart)]
+
+
+@contextmanager
+def startupPhase(name):
+    start = time.time()
+    yield
+    startupPhases.append((name, time.time() - start))
+    print("+ Startup: {} took {:.2f} s".format(name, startupPhases[-1][1]))
 
 
-class Face:
+with startupPhase('openface import'):
+    if args.stubModels:
+        import stub_models as openface
+    else:
+        import openface
+
+with startupPhase('face predictor'):
+    align = openface.AlignDlib(args.dlibFacePredictor)
+model_location = 'model.sav'
+training_dir = 'training_images'
+with startupPhase('embedding cache'):
+    embeddingCache = EmbeddingCache(args.embeddingCache)
+svmTrainer = SVMTrainer(mode=args.svmSearch, nJobs=args.cvJobs,
+                        maxPerIdentity=args.searchPerIdentity)
+galleryIndex = EmbeddingIndex(metric=args.knnMetric, threshold=args.knnThreshold,
+                              k=args.knnNeighbours, nlist=args.knnLists,
+                              nprobe=args.knnProbe)
+
+# The recognition pipeline runs on this pool so the reactor thread stays free
+# for other clients. The Torch network is a single subprocess behind a pipe,
+# so calls into it are serialized with netLock.
+workerPool = ThreadPool(minthreads=1, maxthreads=max(1, args.workers),
+                        name='openface-workers')
+netLock = threading.Lock()
+# Faces failing this gate never reach alignment, embedding or the disk.
+qualityGate = QualityGate(minSize=args.minFaceSize, minSharpness=args.minSharpness,
+                          minBrightness=args.minBrightness,
+                          maxBrightness=args.maxBrightness, maxYaw=args.maxYaw)
+# Stage latencies and counters, reported by STATS and on --metricsPort.
+metrics = Metrics()
+# Per-frame log lines are sampled and written in bulk.
+frameLog = SampledLog(args.logSample)
+# Aligned faces from all sessions are embedded through this batcher. The
+# Torch network is a Lua subprocess behind a pipe, which cannot be shared
+# across fork(), so every serving process starts its own in startNet().
+batcher = EmbeddingBatcher(None, netLock, maxBatch=args.batchSize,
+                           maxWait=args.batchWait / 1000.0, metrics=metrics)
+
+
+def loadPickle(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+# Classifier and unknown embeddings are loaded once per process
+# and shared read-only by every connection.
+sharedState = SharedState()
+sharedState.register('svm', model_location, loadPickle)
+# Mapped rather than read, so every process shares the same pages.
+sharedState.register('unknown', "./examples/web/unknown.npy",
+                     lambda path: np.load(path, mmap_mode='r'))
+
+
+with startupPhase('user store'):
+    userStore = UserStore(args.userDb)
+    userStore.importCsv('User_Details.csv', 'results.csv')
+
+
+# Enrollment images are encoded and written behind the frame path.
+captureWriter = CaptureWriter(maxQueue=args.captureQueue)
+
+
+def commitCaptures(stagingDir, userFolder):
+    # A new user's session directory becomes their training folder in one rename.
+    parent = os.path.dirname(os.path.abspath(userFolder))
+    if not os.path.exists(stagingDir):
+        if not os.path.exists(userFolder):
+            os.makedirs(userFolder)
+            fsyncDir(parent)
+        return
+    if not os.path.exists(userFolder):
+        os.rename(stagingDir, userFolder)
+        fsyncDir(parent)
+    else:
+        for f in os.listdir(stagingDir):
+            shutil.move(os.path.join(stagingDir, f), userFolder)
+        fsyncDir(userFolder)
+        os.rmdir(stagingDir)
+    fsyncDir(os.path.dirname(os.path.abspath(stagingDir)))
+    print("Committed {} to {}".format(stagingDir, userFolder))
+
+
+def commitUser(stagingDir, userFolder):
+    # Blocks until the captures are committed, and raises if that failed;
+    # never call on the reactor.
+    captureWriter.submit(commitCaptures, stagingDir, userFolder).wait()
+
+
+def discardCaptures(stagingDir):
+    if os.path.exists(stagingDir):
+        shutil.move(stagingDir, "./uselessFaces")
+        print("Directory Moved Successful")
+
+
+def startNet():
+    batcher.net = openface.TorchNeuralNet(args.networkModel, imgDim=args.imgDim,
+                                          cuda=args.cuda)
 
-    def __init__(self, rep, identity):
-        self.rep = rep
-        self.identity = identity
 
-    def __repr__(self):
-        return "{{id: {}, rep[0:5]: {}}}".format(
-            str(self.identity),
-            self.rep[0:5]
-        )
+def loadGallery():
+    # Seed the nearest-neighbour gallery from the saved gallery store.
+    saved = GalleryStore.open(args.galleryStore)
+    if saved is not None:
+        for phash, rep, identity in saved.items():
+            galleryIndex.add(phash, rep, identity)
+    print("+ Gallery index holds {} reps.".format(len(galleryIndex)))
+
+
+def saveModel(svm, path=model_location):
+    # Write next to the target and rename so readers never see a partial file.
+    tmpPath = path + '.tmp'
+    with open(tmpPath, 'wb') as f:
+        pickle.dump(svm, f)
+    os.rename(tmpPath, path)
+
+
+def fitSVM(X, y):
+    numIdentities = len(set(y + [-1]))
+    if numIdentities <= 1:
+        return None
+
+    with metrics.timer('train_svm'):
+        svm = svmTrainer.fit(X, y)
+    saveModel(svm)
+    print("Saved in the SVM to model.sav file")
+    return svm
+
+
+def qualityStats(snapshot):
+    """How many faces the quality gate rejected and, from the mean cost
+    of the stages they skipped, roughly how much compute that saved."""
+    stages = snapshot["stages"]
+    counters = snapshot["counters"]
+
+    def meanMs(stage):
+        return stages.get(stage, {}).get("meanMs", 0.0)
+
+    def totalMs(stage):
+        return stages.get(stage, {}).get("count", 0) * meanMs(stage)
+
+    skipped = meanMs('align') + meanMs('phash') + meanMs('forward')
+    rejected = counters.get('quality_rejected', {})
+    savedMs = sum(n * (skipped + (meanMs('landmarks') if reason != 'pose' else 0.0))
+                  for reason, n in rejected.items())
+    spentMs = sum(totalMs(stage) for stage in ('landmarks', 'align', 'phash', 'forward'))
+    checked = counters.get('quality_checked', 0)
+    return {
+        "checked": checked,
+        "rejected": rejected,
+        "rejectedFraction": sum(rejected.values()) / float(max(1, checked)),
+        "savedMs": savedMs,
+        "savedFraction": savedMs / max(1e-9, savedMs + spentMs)
+    }
+
+
+def serverStats():
+    stats = metrics.snapshot()
+    stats["type"] = "STATS"
+    stats["batcher"] = batcher.stats()
+    stats["quality"] = qualityStats(stats)
+    return stats
+
+
+class MetricsResource(Resource):
+    isLeaf = True
+
+    def render_GET(self, request):
+        request.setHeader(b'content-type', b'text/plain; version=0.0.4')
+        return metrics.prometheus().encode('utf8')
+
+
+# Set once warmUp() has run every frame stage; connections that opened
+# before then are sent READY when it flips.
+readiness = {'ready': False, 'error': None, 'waiting': set()}
+
+
+def readyMessage():
+    return {
+        "type": "READY",
+        "ready": readiness['ready'],
+        "error": readiness['error'],
+        "binaryFrames": args.binaryFrames,
+        "uptime": time.time() - bootStart,
+        "startup": [{"phase": name, "seconds": seconds}
+                    for name, seconds in startupPhases]
+    }
+
+
+class ReadyResource(Resource):
+    isLeaf = True
+
+    def render_GET(self, request):
+        request.setHeader(b'content-type', b'application/json')
+        if not readiness['ready']:
+            request.setResponseCode(503)
+        return json.dumps(readyMessage()).encode('utf8')
+
+
+def warmUp():
+    """Run every frame stage once on a synthetic frame, so the first
+    client frame is served at steady-state latency."""
+    noise = np.random.RandomState(0).randint(0, 256, (480, 640, 3)).astype(np.uint8)
+    rgbFrame = EncodedFrame(payload=cv2.imencode('.jpg', noise)[1].tostring()).decode()
+    bb = largestBox(FaceDetector(align, scale=args.detectScale).detect(rgbFrame))
+    if bb is None:
+        import dlib
+        height, width = rgbFrame.shape[:2]
+        bb = dlib.rectangle(width // 4, height // 4, 3 * width // 4, 3 * height // 4)
+    landmarks = align.findLandmarks(rgbFrame, bb)
+    alignedFace = align.align(args.imgDim, rgbFrame, bb, landmarks=landmarks,
+                              landmarkIndices=openface.AlignDlib.OUTER_EYES_AND_NOSE)
+    if alignedFace is None:
+        alignedFace = cv2.resize(rgbFrame, (args.imgDim, args.imgDim))
+    imagehash.phash(Image.fromarray(alignedFace))
+    rep = batcher.forward(alignedFace)
+    if args.classifier == 'knn':
+        galleryIndex.predict(rep)
+    elif sharedState.get('svm') is not None:
+        sharedState.get('svm').predict(rep.tolist())
+    encodeJpeg(rgbFrame, args.annotationQuality)
+
+
+def announceReadiness():
+    msg = json.dumps(readyMessage())
+    for protocol in readiness['waiting']:
+        protocol.sendMessage(msg)
+    readiness['waiting'].clear()
+
+
+def becomeReady(_):
+    readiness['ready'] = True
+    print("+ Ready after {:.2f} s.".format(time.time() - bootStart))
+    announceReadiness()
+
+
+def warmUpFailed(failure):
+    # Frames are still served, but /ready and READY keep saying not ready.
+    log.err(failure, "Warm-up failed")
+    readiness['error'] = "warm-up failed: {}".format(failure.getErrorMessage())
+    announceReadiness()
+
+
+def timedWarmUp():
+    with startupPhase('warm-up'):
+        warmUp()
 
 
 class OpenFaceServerProtocol(WebSocketServerProtocol):
     def __init__(self):
         super(OpenFaceServerProtocol, self).__init__()
-        self.images = {}
+        self.images = GalleryStore()
         self.training = True
         self.testing = False
         self.people = []
@@ -115,11 +472,32 @@ class OpenFaceServerProtocol(WebSocketServerProtocol):
         self.uniqueID = ""
         self.mobileNo = ""
         self.org = ""
-        self.details = None
         self.prediction = -1
-        
-        if args.unknown:
-            self.unknownImgs = np.load("./examples/web/unknown.npy")
+        self.pending = defer.succeed(None)
+        self.retrainCall = None
+        self.retraining = False
+        self.retrainAgain = False
+        self.tracker = FaceTracker(redetectEvery=args.trackEvery,
+                                   minConfidence=args.trackConfidence,
+                                   window=args.voteWindow)
+        self.detector = FaceDetector(align, scale=args.detectScale,
+                                     roiPadding=args.detectRoiPadding,
+                                     fullEvery=args.detectFullEvery)
+        self.captured = {}
+        self.storeError = None
+        self.numCaptured = 0
+        self.numDuplicates = 0
+        # Bumped whenever self.images changes; keys the cached t-SNE.
+        self.dataVersion = 0
+        self.projection = ProjectionCache()
+        # Flow control: at most one frame waits behind the one in progress.
+        self.frameLock = threading.Lock()
+        self.waitingFrame = None
+        self.runningReceived = None
+        self.framesInFlight = 0
+        self.numDropped = 0
+        self.latencyMs = None
+        self.frameInterval = args.minFrameInterval
 
     def onConnect(self, request):
         print("Client connecting: {0}".format(request.peer))
@@ -130,22 +508,107 @@ class OpenFaceServerProtocol(WebSocketServerProtocol):
 
     def onOpen(self):
         print("WebSocket connection open.")
+        if readiness['ready']:
+            self.sendMessage(json.dumps(readyMessage()))
+        else:
+            readiness['waiting'].add(self)
+
+    def schedule(self, inPool, f, *args):
+        """Run f once all earlier work queued on this connection is done.
+
+        With inPool, f runs on the worker pool; otherwise on the reactor.
+        Either way results reach the client in the order messages arrived.
+        """
+        def run(_):
+            if inPool:
+                return threads.deferToThreadPool(reactor, workerPool, f, *args)
+            return f(*args)
+        self.pending.addCallback(run)
+        self.pending.addErrback(log.err)
+
+    def queueFrame(self, f, *args):
+        """Queue a frame for f, latest frame wins.
+
+        A frame still waiting behind the one in progress is replaced by the
+        new one and answered as dropped, so recognition always works on the
+        freshest image and the backlog never grows past one frame.
+        """
+        with self.frameLock:
+            replaced = self.waitingFrame is not None
+            self.waitingFrame = (f, args, time.time())
+        if replaced:
+            self.numDropped += 1
+            metrics.count('frames_dropped')
+            self.sendMessage('{"type": "PROCESSED", "dropped": true}')
+            return
+        self.framesInFlight += 1
+        self.schedule(True, self.runWaitingFrame)
+        self.schedule(False, self.frameDone)
+
+    def runWaitingFrame(self):
+        with self.frameLock:
+            (f, args, self.runningReceived) = self.waitingFrame
+            self.waitingFrame = None
+        f(*args)
+
+    def frameDone(self):
+        self.framesInFlight -= 1
+        latency = 1000.0 * (time.time() - self.runningReceived)
+        metrics.observe('frame_latency', latency)
+        if self.latencyMs is None:
+            self.latencyMs = latency
+        else:
+            self.latencyMs = 0.8 * self.latencyMs + 0.2 * latency
+        self.sendMessage('{"type": "PROCESSED"}')
+        self.adviseRate()
+
+    def adviseRate(self):
+        """Send RATE when the frame interval this session can sustain has
+        moved by 20% or more since the last one."""
+        interval = 1.2 * self.latencyMs
+        if self.waitingFrame is not None:
+            # The client is already ahead of us.
+            interval *= 1.5
+        interval = min(args.maxFrameInterval, max(args.minFrameInterval, interval))
+        if abs(interval - self.frameInterval) < 0.2 * self.frameInterval:
+            return
+        self.frameInterval = interval
+        msg = {
+            "type": "RATE",
+            "interval": int(interval),
+            "queueDepth": self.framesInFlight + (self.waitingFrame is not None),
+            "latencyMs": self.latencyMs,
+            "dropped": self.numDropped
+        }
+        self.sendMessage(json.dumps(msg))
+
+    def sendFromWorker(self, payload):
+        reactor.callFromThread(self.sendMessage, payload)
+
+    def sendMessage(self, payload, *args, **kwargs):
+        with metrics.timer('send'):
+            WebSocketServerProtocol.sendMessage(self, payload, *args, **kwargs)
 
     def onMessage(self, payload, isBinary):
         self.frameNum = self.frameNum + 1
-        print("Received paylod number : "+str(self.frameNum))
-        raw = payload.decode('utf8')
-        msg = json.loads(raw)
-        print("Received {} message of length {}.".format(
-            msg['type'], len(raw)))
+        with metrics.timer('parse'):
+            if isBinary:
+                # Binary frames: JSON header followed by the raw JPEG bytes.
+                msg, frame = parseBinaryFrame(payload)
+            else:
+                msg = json.loads(payload.decode('utf8'))
+                frame = EncodedFrame(dataURL=msg.get('dataURL'))
+        metrics.count('messages', msg['type'])
+        frameLog.log(msg['type'], "Received {} message {} of length {}.",
+                     msg['type'], self.frameNum, len(payload))
 
         if msg['type'] == "TRAINING":
             self.training = msg['val']
             if not self.training:
-                self.trainSVM()
+                self.schedule(False, self.trainSVM)
         elif msg['type'] == "TRAINALLIMAGES":
             print("Calling training all images")
-            self.TrainAllImages()
+            self.schedule(True, self.TrainAllImages)
 
 
         elif msg['type'] == "INFO":
@@ -161,21 +624,17 @@ class OpenFaceServerProtocol(WebSocketServerProtocol):
             print(self.org)
             self.sendMessage('{"type": "END_FACE_COLLECTION"}')
         elif msg['type'] == "TESTING":
-            print("Trying to detect face")
             self.testing = True
-            self.processFrame_testing(msg['dataURL'])
-            self.sendMessage('{"type": "PROCESSED" }')
+            self.queueFrame(self.processFrame_testing, frame)
             #Load SVM
             #self.svm = loaded SVM
 
         elif msg['type'] == "STOPPED_ACK":
             print("Storing Faces-------------------------------------")
-            self.storefaces()
-            print(self.uniqueID)
-            self.sendMessage('{"type": "STORED_PAGE2", "id": ' + self.uniqueID + '}')
+            self.schedule(False, self.storefaces)
         elif msg['type'] == "FEEDBACK":
             print("Taking feedback")
-            self.processFeedback(msg['value'], msg['actualID'])
+            self.schedule(False, self.processFeedback, msg['value'], msg['actualID'])
 
 
         elif msg['type'] == "NULL":
@@ -183,33 +642,28 @@ class OpenFaceServerProtocol(WebSocketServerProtocol):
             self.sendMessage('{"type": "NULL"}')
 
         elif msg['type'] == "FRAME":
-            print("received frame")
-            self.processFrame(msg['dataURL'], msg['identity'], msg['ID'])
-            self.sendMessage('{"type": "PROCESSED"}')
+            self.queueFrame(self.processFrame, frame,
+                            msg['identity'], msg['ID'], self.frameNum)
 
         elif msg['type'] == "register_click":
             print(msg['val'])
 
         elif msg['type'] == "UPDATE_IDENTITY":
             h = msg['hash'].encode('ascii', 'ignore')
-            if h in self.images:
-                self.images[h].identity = msg['idx']
-                if not self.training:
-                    self.trainSVM()
-            else:
-                print("Image not found.")
+            self.schedule(False, self.updateIdentity, h, msg['idx'])
 
         elif msg['type'] == "REMOVE_IMAGE":
             h = msg['hash'].encode('ascii', 'ignore')
-            if h in self.images:
-                del self.images[h]
-                if not self.training:
-                    self.trainSVM()
-            else:
-                print("Image not found.")
+            self.schedule(False, self.removeImage, h)
+
+        elif msg['type'] == "STATS":
+            self.sendMessage(json.dumps(serverStats()))
+
+        elif msg['type'] == "READY":
+            self.sendMessage(json.dumps(readyMessage()))
 
         elif msg['type'] == 'REQ_TSNE':
-            self.sendTSNE(msg['people'])
+            self.schedule(False, self.sendTSNE, msg['people'], msg.get('format', 'png'))
         else:           
             print("Warning: Unknown message type: {}".format(msg['type']))
 
@@ -220,40 +674,66 @@ class OpenFaceServerProtocol(WebSocketServerProtocol):
         self.uniqueID = datetime.datetime.fromtimestamp(ts).strftime('%Y%m%d%H%M%S')
         print("In function storeface:",self.uniqueID)
         
-        #Storing User Details in CSV file
-        d = {'ID': [self.uniqueID], 'Name':[self.UName], 'Mail':[self.MailID], 'Mobile':[self.mobileNo],'Organization':[self.org] }
-        data = pd.DataFrame(data = d)
-        with open('User_Details.csv', 'a') as f:
-            data.to_csv(f, header = False)
+        #Storing User Details
+        userStore.addUser(self.uniqueID, self.UName, self.MailID, self.mobileNo, self.org)
 
         userFolder = "./training_images/"+self.uniqueID
-        if not os.path.exists(userFolder):
-            os.makedirs(userFolder)
-            
-        if os.path.exists(self.dirname):
-            files = os.listdir(self.dirname)
-            for f in files:
-                shutil.move(self.dirname+"/"+f, userFolder) 
-            #shutil.move(self.dirname, userFolder)
-            os.rmdir(self.dirname)
-            print("Creation, moving and deletion done")
-        
+        # Off the reactor: the writer's queue blocks while the disk is behind.
+        # STORED_PAGE2 only goes out once every capture is durably in place.
+        d = threads.deferToThread(commitUser, self.dirname, userFolder)
+        d.addCallbacks(self.facesStored, self.storeFailed)
+        return d
+
+    def facesStored(self, _):
+        print(self.uniqueID)
+        self.sendMessage(json.dumps(self.captureStats()))
+        self.sendMessage('{"type": "STORED_PAGE2", "id": ' + self.uniqueID + '}')
+
+    def storeFailed(self, failure):
+        log.err(failure, "Could not commit the captures of {}".format(self.uniqueID))
+        # Leave whatever is left of the session directory for an operator.
+        self.storeError = failure.getErrorMessage()
+        msg = {
+            "type": "STORE_FAILED",
+            "message": "Your photos could not be saved, please try again"
+        }
+        self.sendMessage(json.dumps(msg))
+
+    def updateIdentity(self, h, idx):
+        if self.images.setIdentity(h, idx):
+            self.dataVersion += 1
+            galleryIndex.add(h, self.images.rep(h), idx)
+            if not self.training:
+                self.trainSVM()
+        else:
+            print("Image not found.")
+
+    def removeImage(self, h):
+        if self.images.remove(h):
+            self.dataVersion += 1
+            galleryIndex.remove(h)
+            if not self.training:
+                self.trainSVM()
+        else:
+            print("Image not found.")
+
     def onClose(self, wasClean, code, reason):
         print("WebSocket connection closed: {0}".format(reason))
         print("Called Close connection")
-        if os.path.exists(self.dirname):
-            print("Inside the if", self.dirname)
-            shutil.move(self.dirname,"./uselessFaces")
-            #shutil.remove(self.dirname)
-            print("Directory Moved Successful")
+        readiness['waiting'].discard(self)
+        if self.storeError is not None:
+            print("Keeping {} after a failed commit: {}".format(self.dirname, self.storeError))
+            return
+        # Behind any frames of this connection still being processed.
+        self.schedule(True, captureWriter.submit, discardCaptures, self.dirname)
 
     def loadState(self, jsImages, training, jsPeople):
         self.training = training
 
         for jsImage in jsImages:
             h = jsImage['hash'].encode('ascii', 'ignore')
-            self.images[h] = Face(np.array(jsImage['representation']),
-                                  jsImage['identity'])
+            self.images.add(h, jsImage['representation'], jsImage['identity'])
+        self.dataVersion += 1
 
         for jsPerson in jsPeople:
             self.people.append(jsPerson.encode('ascii', 'ignore'))
@@ -262,355 +742,568 @@ class OpenFaceServerProtocol(WebSocketServerProtocol):
             self.trainSVM()
 
     def getData(self):
-        X = []
-        y = []
-        for img in self.images.values():
-            X.append(img.rep)
-            y.append(img.identity)
+        # Views straight into the gallery; only augmenting copies.
+        (X, y) = self.images.data()
 
-        numIdentities = len(set(y + [-1])) - 1
+        numIdentities = len(set(y.tolist() + [-1])) - 1
         if numIdentities == 0:
             return None
 
         if args.unknown:
-            numUnknown = y.count(-1)
+            numUnknown = int((y == -1).sum())
             numIdentified = len(y) - numUnknown
-            numUnknownAdd = (numIdentified / numIdentities) - numUnknown
+            numUnknownAdd = (numIdentified // numIdentities) - numUnknown
             if numUnknownAdd > 0:
                 print("+ Augmenting with {} unknown images.".format(numUnknownAdd))
-                for rep in self.unknownImgs[:numUnknownAdd]:
-                    # print(rep)
-                    X.append(rep)
-                    y.append(-1)
+                unknown = sharedState.get('unknown')[:numUnknownAdd]
+                X = np.vstack([X, unknown])
+                y = np.concatenate([y, np.full(len(unknown), -1, dtype=y.dtype)])
 
-        X = np.vstack(X)
-        y = np.array(y)
         return (X, y)
 
-    def sendTSNE(self, people):
-        d = self.getData()
-        if d is None:
-            return
+    def sendTSNE(self, people, format='png'):
+        """Reply with the gallery's t-SNE, computed off the reactor and
+        cached until the images or identities change. With format 'json'
+        the reply carries 2-D points and labels instead of a PNG."""
+        cached = self.projection.get(self.dataVersion)
+        if cached is not None:
+            d = defer.succeed(cached)
         else:
-            (X, y) = d
-
-        X_pca = PCA(n_components=50).fit_transform(X, X)
-        tsne = TSNE(n_components=2, init='random', random_state=0)
-        X_r = tsne.fit_transform(X_pca)
-
-        yVals = list(np.unique(y))
-        colors = cm.rainbow(np.linspace(0, 1, len(yVals)))
-
-        # print(yVals)
-
-        plt.figure()
-        for c, i in zip(colors, yVals):
-            name = "Unknown" if i == -1 else people[i]
-            plt.scatter(X_r[y == i, 0], X_r[y == i, 1], c=c, label=name)
-            plt.legend()
+            data = self.getData()
+            if data is None:
+                return
+            (X, y) = data
+            d = threads.deferToThread(projectTSNE, X, y, args.tsneMaxPoints)
+            d.addCallback(self.cacheProjection, self.dataVersion)
+        d.addCallback(self.projectionMessage, people, format)
+        d.addCallback(lambda msg: self.sendMessage(json.dumps(msg)))
+        d.addErrback(log.err)
+
+    def cacheProjection(self, projection, version):
+        self.projection.put(version, *projection)
+        return projection
+
+    def projectionMessage(self, projection, people, format):
+        (X_r, y) = projection
+        if format == 'json':
+            return {
+                "type": "TSNE_DATA",
+                "points": X_r.tolist(),
+                "labels": [int(i) for i in y]
+            }
+        d = threads.deferToThread(renderScatter, X_r, y, people)
+        d.addCallback(lambda content: {"type": "TSNE_DATA", "content": content})
+        return d
 
-        imgdata = StringIO.StringIO()
-        plt.savefig(imgdata, format='png')
-        imgdata.seek(0)
+    def trainSVM(self):
+        """Request a retrain; bursts of requests coalesce into one.
+
+        Safe to call from any thread. The retrain starts once no further
+        request arrived for --retrainDelay seconds and runs in the background,
+        so recognition keeps using the current model until the new one is in.
+        With --classifier knn the gallery index is updated in place on every
+        change, so there is no SVM to retrain.
+        """
+        if args.classifier == 'knn':
+            return
+        reactor.callFromThread(self.debounceRetrain)
 
-        content = 'data:image/png;base64,' + \
-                  urllib.quote(base64.b64encode(imgdata.buf))
-        msg = {
-            "type": "TSNE_DATA",
-            "content": content
-        }
-        self.sendMessage(json.dumps(msg))
+    def debounceRetrain(self):
+        if self.retrainCall is not None and self.retrainCall.active():
+            self.retrainCall.reset(args.retrainDelay)
+        else:
+            self.retrainCall = reactor.callLater(args.retrainDelay, self.startRetrain)
 
-    def trainSVM(self):
+    def startRetrain(self):
+        if self.retraining:
+            self.retrainAgain = True
+            return
         print("+ Training SVM on {} labeled images.".format(len(self.images)))
         d = self.getData()
         if d is None:
             self.svm = None
             return
-        else:
-            (X, y) = d
-            numIdentities = len(set(y + [-1]))
-            if numIdentities <= 1:
-                return
-
-            param_grid = [
-                {'C': [1, 10, 100, 1000],
-                 'kernel': ['linear']},
-                {'C': [1, 10, 100, 1000],
-                 'gamma': [0.001, 0.0001],
-                 'kernel': ['rbf']}
-            ]
-            self.svm = GridSearchCV(SVC(C=1), param_grid, cv=5).fit(X, y)
-            pickle.dump(self.svm, open(model_location, 'wb'))
-            print("Saved in the SVM to model.sav file")
-
+        (X, y) = d
+        self.retraining = True
+        d = threads.deferToThread(fitSVM, X, y)
+        d.addCallback(self.swapModel)
+        d.addErrback(log.err)
+        d.addBoth(self.retrainDone)
+
+    def swapModel(self, svm):
+        if svm is not None:
+            self.svm = svm
+            sharedState.publish('svm', svm)
+            if args.processes > 1:
+                # Have the supervisor tell every worker to reload now.
+                os.kill(os.getppid(), signal.SIGUSR1)
+
+    def retrainDone(self, _):
+        self.retraining = False
+        if self.retrainAgain:
+            self.retrainAgain = False
+            self.debounceRetrain()
 
     def TrainAllImages(self):
-        # Loading Data into self.images
-        os.chdir('./training_images')
-        for fname in os.listdir("."):
-            if os.path.isdir(fname):
-                print("Reading images in ", fname)
-                self.people.append(int(fname))
-                for i in os.listdir(fname):
-                    alignedFace = cv2.imread(os.path.join(fname,i))
-                    try:
-                        img = net.forward(alignedFace)
-                    except AssertionError:
-                        continue
-                    #print(len(img))
-                    rep = Face(np.array(img), int(fname))
-                    #print(rep)
-                    phash = str(imagehash.phash(Image.fromarray(alignedFace)))
-                    self.images[phash] = rep
-        os.chdir('..')
+        # Start from the gallery saved by the last run, mapped rather than
+        # read, then bring it up to date, embedding only new or changed files.
+        if len(self.images) == 0:
+            saved = GalleryStore.open(args.galleryStore)
+            if saved is not None:
+                self.images = saved
+                self.dataVersion += 1
+
+        def onFace(identity, rep, phash):
+            if self.images.add(phash, rep, identity):
+                self.dataVersion += 1
+            galleryIndex.add(phash, rep, identity)
+
+        def onProgress(stats):
+            print("+ Enrollment: {usersDone}/{users} users, {embedded}/{toEmbed} "
+                  "new images, {imagesPerSec:.1f} images/sec".format(**stats))
+            msg = {"type": "TRAIN_PROGRESS"}
+            msg.update(stats)
+            self.sendFromWorker(json.dumps(msg))
+
+        with metrics.timer('train_all'):
+            (_, phashes) = enrollAll(training_dir, embeddingCache, self.images,
+                                     (args.networkModel, args.imgDim, args.cuda,
+                                      args.stubModels),
+                                     args.enrollProcesses, onFace, onProgress)
+        pruned = self.images.retainOnly(phashes)
+        if pruned:
+            self.dataVersion += 1
+        for phash in pruned:
+            galleryIndex.remove(phash)
+        for identity in sorted(set(self.images.data()[1].tolist())):
+            if identity not in self.people:
+                self.people.append(identity)
+        self.images.save(args.galleryStore)
         self.trainSVM()
 
-    def processFrame(self, dataURL, identity, id):
-        
-        head = "data:image/jpeg;base64,"
-        assert(dataURL.startswith(head))
-        imgdata = base64.b64decode(dataURL[len(head):])
-        imgF = StringIO.StringIO()
-        imgF.write(imgdata)
-        imgF.seek(0)
-        img = Image.open(imgF)
-
-        buf = np.fliplr(np.asarray(img))
-        rgbFrame = np.zeros((300, 400, 3), dtype=np.uint8)
-        rgbFrame[:, :, 0] = buf[:, :, 2]
-        rgbFrame[:, :, 1] = buf[:, :, 1]
-        rgbFrame[:, :, 2] = buf[:, :, 0]
-
-        if not self.training:
-            annotatedFrame = np.copy(buf)
+    def processFrame(self, frame, identity, id, frameNum):
+        with metrics.timer('frame'):
+            self.enrollFrame(frame, identity, id, frameNum)
+
+    def enrollFrame(self, frame, identity, id, frameNum):
+
+        with metrics.timer('decode'):
+            rgbFrame = frame.decode()
+
         identities = []
         assert rgbFrame is not None
-        bbs = align.getAllFaceBoundingBoxes(rgbFrame)
-        print(len(bbs))
+        with metrics.timer('detect'):
+            bbs = self.detector.detect(rgbFrame)
+        frameLog.log('detect', "Detected {} faces in {:.1f} ms",
+                     len(bbs), self.detector.lastMs)
         if len(bbs) > 1:
-            print("More than one person in front of cam")
+            metrics.count('warnings', 'multiple_faces')
             msg = {
                  "type": "WARNING",
                  "message": "Please make ensure only one person is infront of the cam"
              }
-            self.sendMessage(json.dumps(msg))
+            self.sendFromWorker(json.dumps(msg))
             return
 
         if len(bbs) == 0:
-            print("No human face detected")
+            metrics.count('warnings', 'no_face')
             msg = {
                  "type": "WARNING",
                  "message": "No face found, please be present in front of the camera, alone!!"
              }
-            self.sendMessage(json.dumps(msg))
+            self.sendFromWorker(json.dumps(msg))
             return
-        bb = align.getLargestFaceBoundingBox(rgbFrame)
+        bb = largestBox(bbs)
         bbs = [bb] if bb is not None else []
         for bb in bbs:
             # print(len(bbs))
-            landmarks = align.findLandmarks(rgbFrame, bb)
-            alignedFace = align.align(args.imgDim, rgbFrame, bb,
-                                      landmarks=landmarks,
-                                      landmarkIndices=openface.AlignDlib.OUTER_EYES_AND_NOSE)
+            landmarks = self.checkQuality(rgbFrame, bb)
+            if landmarks is None:
+                continue
+            with metrics.timer('align'):
+                alignedFace = align.align(args.imgDim, rgbFrame, bb,
+                                          landmarks=landmarks,
+                                          landmarkIndices=openface.AlignDlib.OUTER_EYES_AND_NOSE)
             if alignedFace is None:
                 continue
 
-            phash = str(imagehash.phash(Image.fromarray(alignedFace)))
+            with metrics.timer('phash'):
+                phash = str(imagehash.phash(Image.fromarray(alignedFace)))
             if phash in self.images:
-                identity = self.images[phash].identity
+                identity = self.images.identity(phash)
             else:
-
-                print("came here")
-                print("Unique Id: ",id)
                 if(id == 0):
                     tempPath = self.dirname
-                    if not os.path.exists(tempPath):
-                        os.makedirs(tempPath)         
-
-                    cv2.imwrite(tempPath+"/"+str(self.frameNum)+".jpeg", alignedFace)
                 else:
                     tempPath = 'training_images/'+str(id)
-                    if not os.path.exists(tempPath):
-                        os.makedirs(tempPath) 
-                    cv2.imwrite(tempPath+"/"+str(id)+str(self.frameNum)+".jpeg", alignedFace)
+                if self.isNearDuplicate(tempPath, phash):
+                    continue
+                if(id == 0):
+                    captureWriter.write(tempPath+"/"+str(frameNum)+".jpeg", alignedFace)
+                else:
+                    captureWriter.write(tempPath+"/"+str(id)+str(frameNum)+".jpeg", alignedFace)
+
+    def checkQuality(self, rgbFrame, bb):
+        """The face's landmarks if it passes the quality gate; otherwise
+        None, after telling the client why it was rejected."""
+        metrics.count('quality_checked')
+        with metrics.timer('quality'):
+            reason = qualityGate.checkFace(rgbFrame, bb)
+        landmarks = None
+        if reason is None:
+            with metrics.timer('landmarks'):
+                landmarks = align.findLandmarks(rgbFrame, bb)
+            reason = qualityGate.checkPose(landmarks)
+        if reason is None:
+            return landmarks
+        metrics.count('quality_rejected', reason)
+        msg = {
+            "type": "WARNING",
+            "reason": reason,
+            "message": QUALITY_MESSAGES[reason]
+        }
+        self.sendFromWorker(json.dumps(msg))
+        return None
+
+    def captureIndex(self, userDir):
+        # Seed a known user's index with the phashes of their stored images.
+        index = self.captured.get(userDir)
+        if index is None:
+            index = self.captured[userDir] = BKTree()
+            prefix = os.path.join(os.path.normpath(userDir), '')
+            for imgPath, entry in embeddingCache.items():
+                if imgPath.startswith(prefix) and entry['phash']:
+                    index.add(entry['phash'])
+        return index
+
+    def isNearDuplicate(self, userDir, phash):
+        """Whether phash is too close to a frame already captured for the
+        user; otherwise it is recorded as captured."""
+        index = self.captureIndex(userDir)
+        if args.dupRadius >= 0 and index.nearest(phash, args.dupRadius) is not None:
+            self.numDuplicates += 1
+            duplicate = True
+        else:
+            index.add(phash)
+            self.numCaptured += 1
+            duplicate = False
+        if (self.numCaptured + self.numDuplicates) % 10 == 0:
+            self.sendFromWorker(json.dumps(self.captureStats()))
+        return duplicate
+
+    def captureStats(self):
+        return {
+            "type": "CAPTURE_STATS",
+            "captured": self.numCaptured,
+            "duplicates": self.numDuplicates
+        }
 
-    def processFrame_testing(self, dataURL):
-        
-        head = "data:image/jpeg;base64,"
-        assert(dataURL.startswith(head))
-        imgdata = base64.b64decode(dataURL[len(head):])
-        imgF = StringIO.StringIO()
-        imgF.write(imgdata)
-        imgF.seek(0)
-        img = Image.open(imgF)
-
-        buf = np.fliplr(np.asarray(img))
-        rgbFrame = np.zeros((300, 400, 3), dtype=np.uint8)
-        rgbFrame[:, :, 0] = buf[:, :, 2]
-        rgbFrame[:, :, 1] = buf[:, :, 1]
-        rgbFrame[:, :, 2] = buf[:, :, 0]
-
-        if self.testing:
-            annotatedFrame = np.copy(buf)
+    def processFrame_testing(self, frame):
+        with metrics.timer('frame_testing'):
+            self.recognizeFrame(frame)
+
+    def recognizeFrame(self, frame):
+
+        with metrics.timer('decode'):
+            rgbFrame = frame.decode()
+        overlays = []
 
         # cv2.imshow('frame', rgbFrame)
         # if cv2.waitKey(1) & 0xFF == ord('q'):
         #     return
 
-        ####### loading SVM (Load svm)
-        if self.svm is None:
-            print("Loading SVM model file")
-            self.svm = pickle.load(open(model_location, 'rb'))
-            print(self.svm)
-
-        #Opening CSV
-        if self.details is None:
-            self.details = pd.read_csv('User_Details.csv')
+        ####### SVM, shared across connections
+        if args.classifier == 'svm':
+            self.svm = sharedState.get('svm')
 
         #identities = []
         identity = -1
+        user = None
         # bbs = align.getAllFaceBoundingBoxes(rgbFrame)
 
         assert rgbFrame is not None
-        bbs = align.getAllFaceBoundingBoxes(rgbFrame)
-        print(len(bbs))
-        if len(bbs) > 1:
-            print("More than one person in front of cam")
-            msg = {
-                 "type": "WARNING",
-                 "message": "Please make ensure only one person is infront of the cam"
-             }
-            self.sendMessage(json.dumps(msg))
-            return
+        # Follow the face from the previous frame when the tracker is
+        # confident; otherwise detect and embed it again.
+        with metrics.timer('track'):
+            tracked = self.tracker.track(rgbFrame)
+        if tracked is None:
+            with metrics.timer('detect'):
+                bbs = self.detector.detect(rgbFrame)
+            frameLog.log('detect', "Detected {} faces in {:.1f} ms",
+                         len(bbs), self.detector.lastMs)
+            if len(bbs) > 1:
+                metrics.count('warnings', 'multiple_faces')
+                self.tracker.reset()
+                msg = {
+                     "type": "WARNING",
+                     "message": "Please make ensure only one person is infront of the cam"
+                 }
+                self.sendFromWorker(json.dumps(msg))
+                return
 
-        if len(bbs) == 0:
-            print("No human face detected")
-            msg = {
-                 "type": "WARNING",
-                 "message": "No face found, please be present in front of the camera, alone!!"
-             }
-            self.sendMessage(json.dumps(msg))
-            return
-        
-        ##------------------End of Handling no face or more than one face ----------------------------------
+            if len(bbs) == 0:
+                metrics.count('warnings', 'no_face')
+                self.tracker.reset()
+                msg = {
+                     "type": "WARNING",
+                     "message": "No face found, please be present in front of the camera, alone!!"
+                 }
+                self.sendFromWorker(json.dumps(msg))
+                return
+
+            ##------------------End of Handling no face or more than one face ----------------------------------
+
+            bb = largestBox(bbs)
+            bbs = [bb] if bb is not None else []
+        else:
+            metrics.count('tracked_frames')
+            bbs = [tracked]
 
-        bb = align.getLargestFaceBoundingBox(rgbFrame)
-        bbs = [bb] if bb is not None else []
         for bb in bbs:
             # print(len(bbs))
-            landmarks = align.findLandmarks(rgbFrame, bb)
-            alignedFace = align.align(args.imgDim, rgbFrame, bb,
-                                      landmarks=landmarks,
-                                      landmarkIndices=openface.AlignDlib.OUTER_EYES_AND_NOSE)
-            if alignedFace is None:
-                continue
-
-            phash = str(imagehash.phash(Image.fromarray(alignedFace)))
-            if phash in self.images:
-                identity = self.images[phash].identity
+            if tracked is not None:
+                with metrics.timer('landmarks'):
+                    landmarks = align.findLandmarks(rgbFrame, bb)
+                identity = self.tracker.identity
             else:
-                rep = net.forward(alignedFace)
-                #print(rep)
-                #if self.training:
-                #    self.images[phash] = Face(rep, identity)
-                #    # TODO: Transferring as a string is suboptimal.
-                #    content = [str(x) for x in cv2.resize(alignedFace, (0,0),
-                #    fx=0.5, fy=0.5).flatten()]
-                #    content = [str(x) for x in alignedFace.flatten()]
-                #    msg = {
-                #        "type": "NEW_IMAGE",
-                #        "hash": phash,
-                #        "content": content,
-                #        "identity": identity,
-                #        "representation": rep.tolist()
-                #    }
-                #    self.sendMessage(json.dumps(msg))
-                #else
-                if self.testing:
-                    #if len(self.people) == 0:
-                    #    identity = -1
-                    #elif len(self.people) == 1:
-                    #    identity = 0
-                    if self.svm:
-                        print("Came here")
-                        identity = self.svm.predict(rep.tolist())[0]
-                    else:
-                        print("hhh")
-                        identity = -1
-                    #if identity not in identities:
-                    #    identities.append(identity)
-                self.prediction = identity
+                landmarks = self.checkQuality(rgbFrame, bb)
+                if landmarks is None:
+                    continue
+                identity = self.identifyFace(rgbFrame, bb, landmarks)
+                if identity is None:
+                    identity = -1
+                    continue
+                identity = self.tracker.start(rgbFrame, bb, identity)
+            self.prediction = identity
             #if not self.training:
             if self.testing:
-                bl = (bb.left(), bb.bottom())
-                tr = (bb.right(), bb.top())
-                cv2.rectangle(annotatedFrame, bl, tr, color=(153, 255, 204),
-                              thickness=3)
-                for p in openface.AlignDlib.OUTER_EYES_AND_NOSE:
-                    cv2.circle(annotatedFrame, center=landmarks[p], radius=3,
-                               color=(102, 204, 255), thickness=-1)
-                if identity == -1:
+                if identity != -1:
+                    user = userStore.get(identity)
+                if user is None:
                     if len(self.people) == 1:
                         name = self.people[0]
                     else:
                         name = "Unknown"
                 else:
                     #name = self.people[identity]
-                    details = self.details[self.details['ID']==identity]
-                    #print(details)
-                    name  = details['Name'].values[0]
-                    print(name)
-                cv2.putText(annotatedFrame, name, (bb.left(), bb.top() - 10),
-                            cv2.FONT_HERSHEY_SIMPLEX, fontScale=0.75,
-                            color=(152, 255, 204), thickness=2)
+                    name = user['name']
+                    frameLog.log('recognized', "Recognized {}", name)
+                overlays.append(faceOverlay(bb, landmarks,
+                                            openface.AlignDlib.OUTER_EYES_AND_NOSE,
+                                            name))
 
         # if not self.training:
-        if identity!=-1 and self.testing:
+        if user is not None and self.testing:
             msg = {
                 "type": "IDENTITIES",
                 "identities": identity,
-                "name": details['Name'].values[0],
-                "mail": details['Mail'].values[0],
-                "company": details['Company'].values[0]
+                "name": user['name'],
+                "mail": user['mail'],
+                "company": user['company']
             }
-            self.sendMessage(json.dumps(msg))
-
-            plt.figure()
-            plt.imshow(annotatedFrame)
-            plt.xticks([])
-            plt.yticks([])
-
-            imgdata = StringIO.StringIO()
-            plt.savefig(imgdata, format='png')
-            imgdata.seek(0)
-            content = 'data:image/png;base64,' + \
-                urllib.quote(base64.b64encode(imgdata.buf))
-            msg = {
-                "type": "ANNOTATED",
-                "content": content
+            self.sendFromWorker(json.dumps(msg))
+            with metrics.timer('annotate'):
+                annotated = json.dumps(self.annotate(rgbFrame, overlays))
+            self.sendFromWorker(annotated)
+
+    def identifyFace(self, rgbFrame, bb, landmarks):
+        with metrics.timer('align'):
+            alignedFace = align.align(args.imgDim, rgbFrame, bb,
+                                      landmarks=landmarks,
+                                      landmarkIndices=openface.AlignDlib.OUTER_EYES_AND_NOSE)
+        if alignedFace is None:
+            return None
+
+        with metrics.timer('phash'):
+            phash = str(imagehash.phash(Image.fromarray(alignedFace)))
+        if phash in self.images:
+            return self.images.identity(phash)
+        rep = batcher.forward(alignedFace)
+        with metrics.timer('classify'):
+            if args.classifier == 'knn':
+                return galleryIndex.predict(rep)
+            elif self.svm:
+                return self.svm.predict(rep.tolist())[0]
+            return -1
+
+    def annotate(self, bgrFrame, overlays):
+        if args.annotation == 'json':
+            # The browser draws the overlay on its own copy of the frame.
+            return {
+                "type": "ANNOTATIONS",
+                "width": bgrFrame.shape[1],
+                "height": bgrFrame.shape[0],
+                "faces": overlays
             }
-            plt.close()
-            self.sendMessage(json.dumps(msg))
+        if args.annotation == 'jpeg':
+            annotatedFrame = bgrFrame.copy()
+            for overlay in overlays:
+                drawOverlay(annotatedFrame, overlay, bgr=True)
+            content = encodeJpeg(annotatedFrame, args.annotationQuality)
+        else:
+            annotatedFrame = cv2.cvtColor(bgrFrame, cv2.COLOR_BGR2RGB)
+            for overlay in overlays:
+                drawOverlay(annotatedFrame, overlay)
+            content = encodePng(annotatedFrame)
+        return {
+            "type": "ANNOTATED",
+            "content": content
+        }
+
     def processFeedback(self,value, actualMail):
         print("SYYYYYYYYYYYYYYYYYYYYYY")
-        predictedMail = self.details[self.details['ID'] == self.prediction]['Mail'].values[0]
         if value == True:
-            d = {'Result': [value], 'ActualMail':[actualMail], 'PredictedMail':[actualMail]}
+            predictedMail = actualMail
         else:
-            d = {'Result': [value], 'ActualMail':[actualMail], 'PredictedMail':[predictedMail]}
-        data = pd.DataFrame(data = d)
-        with open('results.csv', 'a') as f:
-            data.to_csv(f, header = False)
+            predictedMail = userStore.get(self.prediction)['mail']
+        userStore.addResult(actualMail, predictedMail, value)
         print("feedback taken")
 
-def main(reactor):
+def preload():
+    # Loaded before any fork so worker processes share them copy-on-write.
+    with startupPhase('classifier'):
+        if args.classifier == 'knn':
+            loadGallery()
+        else:
+            sharedState.get('svm')
+        if args.unknown:
+            sharedState.get('unknown')
+
+
+def main(reactor, sock=None, index=0):
     log.startLogging(sys.stdout)
     factory = WebSocketServerFactory()
     factory.protocol = OpenFaceServerProtocol
     ctx_factory = DefaultOpenSSLContextFactory(tls_key, tls_crt)
-    reactor.listenSSL(args.port, factory, ctx_factory)
+    with startupPhase('network'):
+        startNet()
+    if sock is None:
+        sharedState.startWatching(args.reloadInterval)
+    task.LoopingCall(userStore.flush).start(args.userFlushInterval, now=False)
+    task.LoopingCall(frameLog.flush).start(args.logFlushInterval, now=False)
+    reactor.addSystemEventTrigger('during', 'shutdown', frameLog.flush)
+    reactor.addSystemEventTrigger('during', 'shutdown', userStore.close)
+    workerPool.start()
+    batcher.start()
+    captureWriter.start()
+    reactor.addSystemEventTrigger('during', 'shutdown', workerPool.stop)
+    reactor.addSystemEventTrigger('during', 'shutdown', batcher.stop)
+    reactor.addSystemEventTrigger('during', 'shutdown', captureWriter.stop)
+    if sock is None:
+        reactor.listenSSL(args.port, factory, ctx_factory)
+    else:
+        # All workers accept from the supervisor's listening socket.
+        reactor.adoptStreamPort(sock.fileno(), socket.AF_INET,
+                                TLSMemoryBIOFactory(ctx_factory, False, factory))
+    if args.metricsPort:
+        root = Resource()
+        root.putChild(b'metrics', MetricsResource())
+        root.putChild(b'ready', ReadyResource())
+        reactor.listenTCP(args.metricsPort + index, Site(root), interface='127.0.0.1')
+    # Frames are accepted straight away; READY tells clients when they are
+    # served at full speed.
+    d = threads.deferToThreadPool(reactor, workerPool, timedWarmUp)
+    d.addCallbacks(becomeReady, warmUpFailed)
     return defer.Deferred()
 
+
+def runWorker(sock, index):
+    """Body of a forked serving process; never returns."""
+    global reactor
+    status = 1
+    try:
+        for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGUSR1):
+            signal.signal(signum, signal.SIG_DFL)
+        from twisted.internet import reactor
+        userStore.reopen()
+        # A restarted worker is forked from the supervisor's copy of the
+        # shared state, which may predate the last reload broadcast, so
+        # catch up before serving.
+        for name in sharedState.loaders:
+            sharedState.reloadIfChanged(name)
+        # The supervisor signals a model change to all workers at once.
+        signal.signal(signal.SIGUSR1,
+                      lambda signum, frame: reactor.callFromThread(sharedState.poll))
+        task.react(main, [sock, index])
+    except SystemExit as e:
+        status = e.code or 0
+    except Exception:
+        log.err()
+    finally:
+        sys.stdout.flush()
+        os._exit(status)
+
+
+def supervise():
+    """Fork --processes workers sharing one listening socket, restart any
+    that die, and broadcast model reloads.
+
+    A worker that retrains signals SIGUSR1; the supervisor also polls the
+    shared model files itself. Either way every worker is sent SIGUSR1 and
+    reloads together.
+    """
+    if 'twisted.internet.reactor' in sys.modules:
+        raise RuntimeError("The reactor must not be installed before forking workers.")
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('', args.port))
+    sock.listen(128)
+    sock.setblocking(False)
+
+    children = {}
+    state = {'reload': False, 'stopping': False}
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            runWorker(sock, index)
+        children[pid] = index
+        print("Started worker {} (pid {}).".format(index, pid))
+
+    def onReload(signum, frame):
+        state['reload'] = True
+
+    def onStop(signum, frame):
+        state['stopping'] = True
+
+    signal.signal(signal.SIGUSR1, onReload)
+    signal.signal(signal.SIGINT, onStop)
+    signal.signal(signal.SIGTERM, onStop)
+
+    watched = [path for path, _ in sharedState.loaders.values()]
+    signatures = [fileSignature(path) for path in watched]
+    for index in range(args.processes):
+        spawn(index)
+
+    while children:
+        time.sleep(args.reloadInterval)
+        if state['stopping']:
+            for pid in children:
+                os.kill(pid, signal.SIGTERM)
+            for pid in list(children):
+                os.waitpid(pid, 0)
+            break
+        while children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                break
+            index = children.pop(pid, None)
+            if index is not None:
+                print("Worker {} (pid {}) exited with status {}; restarting.".format(
+                    index, pid, status))
+                spawn(index)
+        current = [fileSignature(path) for path in watched]
+        if state['reload'] or current != signatures:
+            state['reload'] = False
+            signatures = current
+            for pid in children:
+                os.kill(pid, signal.SIGUSR1)
+
+
 if __name__ == '__main__':
-    task.react(main)
+    preload()
+    if args.processes > 1:
+        supervise()
+    else:
+        from twisted.internet import reactor
+        task.react(main)